@@ -5,3 +5,4 @@ from . import info
 from . import color
 from . import systems
 from . import model
+from . import fsm
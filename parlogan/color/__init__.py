@@ -1 +1,2 @@
-from .color import paranal, SELINS, PRESET
\ No newline at end of file
+from .color import colorize, paranal, SELINS, PRESET, colorize_series, SELINS_profile, profiles, \
+    colorize_cache_info, clear_colorize_cache
@@ -1,5 +1,8 @@
 from .config import *
 
+def _stopword_number(match):
+    return " " if match.group().startswith(" ") else "{}"
+
 def colorize(l):
     """Applies substitutions in a string to remove irrelevant words or characters.
 
@@ -9,12 +12,87 @@ def colorize(l):
     Returns:
         (string): modified string
     """
-    l = regex_UTCdate.sub( r"_date_", l )
+    if "-" in l:
+        l = regex_UTCdate.sub( r"_date_", l )
     l = regex_symbols.sub( r" ", l )
-    l = regex_stopwords.sub( r"\1\3", l )
-    l = regex_numbers.sub( r"\1{}", l)
-    l = re.sub(' {2,}', ' ', l) 
-    return l.strip()
+    #stopwords and numbers in one pass, then extra spaces out
+    l = regex_stopwords_numbers.sub( _stopword_number, l )
+    return " ".join(l.split())
+
+
+class Colorizer:
+    """Colorizer compiled from a rule set. Rules are applied in order and skipped
+    when their guard says they can't match, then the string is colorized.
+    Colorized logs are remembered in a LRU cache, logs repeat a lot.
+
+    Attributes:
+        rules: list of (regex, replacement, guard)
+        repeated: logs colorized in batches that were repeated inside the batch
+    """
+
+    def __init__(self, rules, cache_size = colorize_cache_size):
+        self.rules = list(rules)
+        self.cached = lru_cache(maxsize = cache_size)(self.colorize)
+        self.repeated = 0
+
+    def colorize(self, l):
+        """Colorizes l, without the cache."""
+        for regex, repl, guard in self.rules:
+            if guard is None or any(literal in l for literal in guard):
+                l = regex.sub(repl, l)
+        return colorize(l)
+
+    def __call__(self, l):
+        return self.cached(l)
+
+    def colorize_series(self, series):
+        """Colorizes a column, every distinct log only once.
+
+        Args:
+            series (Series): strings to be modified
+
+        Returns:
+            (Series): modified strings, with the index of series.
+        """
+        codes, uniques = pd.factorize(series)
+        self.repeated += int((codes >= 0).sum()) - len(uniques)
+        #code -1 (missing log) takes the last value
+        colored = np.array([self.cached(l) for l in uniques] + [np.nan], dtype = object)
+        return pd.Series(colored[codes], index = series.index)
+
+    def cache_info(self):
+        """Hits, misses and size of the cache. Repeated logs in a batch count as hits."""
+        info = self.cached.cache_info()
+        hits = info.hits + self.repeated
+        lookups = hits + info.misses
+        return {
+            'hits': hits,
+            'misses': info.misses,
+            'size': info.currsize,
+            'max size': info.maxsize,
+            'hit rate': hits / lookups if lookups else 0.,
+        }
+
+    def cache_clear(self):
+        self.cached.cache_clear()
+        self.repeated = 0
+
+
+#every colorizer available, by profile name
+profiles = {
+    'colorize': Colorizer([]),
+    'paranal': Colorizer(paranal_rules),
+    'SELINS': Colorizer(selins_rules + selins_move_rules['standard'] + paranal_rules),
+    'SELINS NA': Colorizer(selins_rules + selins_move_rules['NA'] + paranal_rules),
+    'SELINS CO': Colorizer(selins_rules + selins_move_rules['CO'] + paranal_rules),
+    'PRESET': Colorizer(preset_rules + paranal_rules),
+}
+
+def SELINS_profile(mode = 'standard'):
+    """Name of the profile of a SELINS mode (standard, NA or CO)."""
+    if mode in ('NA', 'CO'):
+        return 'SELINS ' + mode
+    return 'SELINS'
 
 def paranal(l):
     """Applies substitutions in a string to remove irrelevant words or characters,
@@ -26,13 +104,7 @@ def paranal(l):
     Returns:
         (string): modified string
     """
-    #replace in string l, any obs_param with 
-    l = regex_obs_param.sub(r"\1 000", l)
-    l = regex_procname.sub(r"\1_X", l)
-    l = regex_fits.sub(r"0_fits", l)
-    l = regex_telescope_prefix.sub(r"\1X\2", l)
-    l = regex_cmd.sub(r"cmdX", l)
-    return colorize(l)
+    return profiles['paranal'](l)
 
 def SELINS(l, mode = 'standard'):
     """Applies substitutions in a string to remove irrelevant words or characters,
@@ -45,17 +117,7 @@ def SELINS(l, mode = 'standard'):
     Returns:
         (string): modified string
     """
-    l = regex_selins_start.sub(r"SELINS Buffer", l)
-    l = regex_standby.sub(r"{X} focus STANDBY", l)
-    l = regex_online.sub(r"{Y} focus ONLINE", l)
-    if mode == 'NA':
-        l = regex_move_NA.sub(r"M2 M3 from NA {X}", l)
-    elif mode == 'CO':
-        l = regex_move_CO.sub(r"M2 M3 from CO {X}", l)
-    else:
-        l = regex_move_XY.sub(r"M2 M3 from {X} {Y}", l)
-        l = regex_move_XX.sub(r"M2 M3 from {X} {X}", l)
-    return paranal(l)
+    return profiles[SELINS_profile(mode)](l)
 
 def PRESET(l):
     """Applies substitutions in a string to remove irrelevant words or characters,
@@ -67,6 +129,32 @@ def PRESET(l):
     Returns:
         (string): modified string
     """
-    l = PRESET_start_re.sub(r'PRESET SETUP', l)
-    l = PRESET_end_re.sub(r'PRESET SUCCESS', l)
-    return paranal(l)
+    return profiles['PRESET'](l)
+
+def colorize_series(series, profile = 'paranal'):
+    """Colorizes a whole column of logs. Every distinct log is colorized once, and
+    only if it is not in the cache of the profile.
+
+    Args:
+        series (Series): strings to be modified
+        profile (string): colorize, paranal, SELINS, SELINS NA, SELINS CO or PRESET.
+
+    Returns:
+        (Series): modified strings, with the index of series.
+    """
+    return profiles[profile].colorize_series(series)
+
+def colorize_cache_info():
+    """Cache usage of every profile.
+
+    Returns:
+        (DataFrame): hits, misses, size, max size and hit rate by profile.
+    """
+    return pd.DataFrame.from_dict(
+        {name: colorizer.cache_info() for name, colorizer in profiles.items()}, orient = 'index'
+    )
+
+def clear_colorize_cache():
+    """Empties the cache of every profile."""
+    for colorizer in profiles.values():
+        colorizer.cache_clear()
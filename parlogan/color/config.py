@@ -1,4 +1,10 @@
 import re
+import pandas as pd
+import numpy as np
+from functools import lru_cache
+
+#colorized logs remembered by every profile
+colorize_cache_size = 100000
 
 #color regex
 regex_symbols = re.compile(r"\W+")
@@ -25,3 +31,38 @@ regex_online = re.compile(r"([A-Z]{2}) focus to ONLINE")
 #preset regex
 PRESET_start_re = re.compile(r"PRESET: Received command: SETUP.*")
 PRESET_end_re = re.compile(r"PRESET: Succesfully completed.*")
+
+#colorize regex fused after symbols are removed: only words and single spaces are
+#left, so stopwords are whole words between spaces and numbers start a word
+regex_stopwords_numbers = re.compile(r" (?:at|to|for|s|with|by|is|the|of) |(?<![^ ])\d+")
+
+#rule sets: (regex, replacement, guard). Rules are applied in order, a rule is
+#skipped when none of the literals of its guard is in the string (the regex can't
+#match then). A None guard always applies.
+paranal_rules = [
+    (regex_obs_param, r"\1 000", ("OBS.", "SEQ.", "INS.")),
+    (regex_procname, r"\1_X", ("_",)),
+    (regex_fits, r"0_fits", (".fits",)),
+    (regex_telescope_prefix, r"\1X\2", None),
+    (regex_cmd, r"cmdX", ("cmd",)),
+]
+
+selins_rules = [
+    (regex_selins_start, r"SELINS Buffer", ("SELINS, Buffer",)),
+    (regex_standby, r"{X} focus STANDBY", (" focus to STANDBY",)),
+    (regex_online, r"{Y} focus ONLINE", (" focus to ONLINE",)),
+]
+
+selins_move_rules = {
+    'standard': [
+        (regex_move_XY, r"M2 M3 from {X} {Y}", ("M2 & M3 from ",)),
+        (regex_move_XX, r"M2 M3 from {X} {X}", ("M2 & M3 from ",)),
+    ],
+    'NA': [(regex_move_NA, r"M2 M3 from NA {X}", ("M2 & M3 from NA to ",))],
+    'CO': [(regex_move_CO, r"M2 M3 from CO {X}", ("M2 & M3 from CO to ",))],
+}
+
+preset_rules = [
+    (PRESET_start_re, r'PRESET SETUP', ("PRESET: Received command: SETUP",)),
+    (PRESET_end_re, r'PRESET SUCCESS', ("PRESET: Succesfully completed",)),
+]
@@ -1,6 +1,16 @@
 import pandas as pd
-from parlogan.db.es import log_scan
-from parlogan.color import SELINS
+from parlogan.db.es import log_scan, es_scan_slices, timestamps_to_datetime
+from parlogan.color import SELINS, colorize_series, SELINS_profile
 import numpy as np
+import networkx as nx
+from parlogan.fsm import LogFSM, compiled_fsm
 import os
 package_directory = os.path.dirname(os.path.abspath(__file__))
+
+#substrings that mark the events of a SELINS execution
+SELINS_event_keys = {
+    'start': "MSW: Received command: SELINS, Buffer:",
+    'mswERR_TARGET_TIMEOUT': "mswERR_TARGET_TIMEOUT",
+    'command_failed': "Command failed (SELINS)",
+    'end': "Telescope active optics calibrated correction",
+}
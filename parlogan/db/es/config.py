@@ -1,9 +1,55 @@
 from elasticsearch_dsl import Search
 from elasticsearch import Elasticsearch
 from elasticsearch.helpers import scan
+try:
+    from elasticsearch import AsyncElasticsearch
+    from elasticsearch.helpers import async_scan
+except ImportError:
+    #elasticsearch older than 7.8 or aiohttp missing, only blocking queries
+    AsyncElasticsearch = None
+    async_scan = None
+import asyncio
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import numpy as np
+import threading
+import hashlib
+import json
+import os
+import shutil
+import uuid
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+import atexit
 pd.options.mode.chained_assignment = None
 
+#shared client settings
+es_hosts = ["wgsdlab5"]
+es_maxsize = 25 #connections kept alive per host
+es_timeout = 100
+es_max_retries = 3
+es_retry_on_timeout = True
+es_http_compress = True
+
+#slices used to scan long time windows
+es_scan_slices = 4
+
+#windows closer than this are fetched with a single scan
+es_coalesce_gap = '1 hour'
+
+#independent queries running at the same time
+es_max_workers = 8
+
+#local cache of scans, logs newer than es_cache_settle might still be arriving
+#and are never cached
+es_cache_folder = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'cache', 'es')
+es_cache_settle = '15 minutes'
+
+#fields with few distinct values, stored as categoricals
+categorical_fields = ["system", "envname", "procname", "logtype"]
+
 class Error(Exception):
    """Base class for other exceptions"""
    pass
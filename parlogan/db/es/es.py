@@ -1,5 +1,103 @@
 from .config import *
 
+_client = None
+_async_client = None
+_async_client_loop = None
+_client_lock = threading.Lock()
+_client_settings = {
+    "hosts": es_hosts,
+    "maxsize": es_maxsize,
+    "timeout": es_timeout,
+    "max_retries": es_max_retries,
+    "retry_on_timeout": es_retry_on_timeout,
+    "http_compress": es_http_compress,
+}
+
+def configure_client(**settings):
+    """Changes the settings of the shared ES client. The current client is closed,
+    the next query opens a new one with the new settings.
+
+    Args:
+        hosts (list[string]): ES nodes.
+        maxsize (int): connections kept alive per host, also the max of concurrent
+            requests per host.
+        timeout (int): default request timeout in seconds.
+        max_retries (int): retries of a failed request.
+        retry_on_timeout (bool): if to retry a request that timed out.
+        http_compress (bool): if to gzip the responses.
+
+    The async client is dropped too, close it first with close_async_client if
+    it is in use.
+    """
+    global _async_client
+    unknown = set(settings) - set(_client_settings)
+    if unknown:
+        raise TypeError("Unknown client settings: %s" % ", ".join(sorted(unknown)))
+    with _client_lock:
+        _client_settings.update(settings)
+        _close_client()
+        _async_client = None
+
+def get_client():
+    """Shared ES client. Its connection pool is reused by every query.
+
+    Returns:
+        (Elasticsearch): client
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            settings = dict(_client_settings)
+            _client = Elasticsearch(
+                settings.pop("hosts"),
+                headers = {"Connection": "keep-alive"},
+                **settings
+            )
+        return _client
+
+def _close_client():
+    global _client
+    if _client is not None:
+        _client.transport.close()
+        _client = None
+
+def close_client():
+    """Closes the shared ES client and all its connections."""
+    with _client_lock:
+        _close_client()
+
+atexit.register(close_client)
+
+def get_async_client():
+    """Shared async ES client, with the same settings of the blocking one. It
+    belongs to the running event loop, a new loop gets a new client.
+
+    Returns:
+        (AsyncElasticsearch): client
+    """
+    global _async_client, _async_client_loop
+    if AsyncElasticsearch is None:
+        raise ImportError("Async queries need elasticsearch >= 7.8 and aiohttp")
+    loop = asyncio.get_event_loop()
+    with _client_lock:
+        if _async_client is None or _async_client_loop is not loop:
+            settings = dict(_client_settings)
+            _async_client = AsyncElasticsearch(
+                settings.pop("hosts"),
+                headers = {"Connection": "keep-alive"},
+                **settings
+            )
+            _async_client_loop = loop
+        return _async_client
+
+async def close_async_client():
+    """Closes the shared async ES client and all its connections."""
+    global _async_client
+    with _client_lock:
+        client, _async_client = _async_client, None
+    if client is not None:
+        await client.close()
+
 def log_query(query, start, end, index = "vltlog*"):
     """ES query to retrieve logs
 
@@ -13,8 +111,7 @@ def log_query(query, start, end, index = "vltlog*"):
         (pandas.DataFrame): hits of the query
 
     """
-    client = Elasticsearch("wgsdlab5")
-    s = Search(using = client, index=index).query({
+    s = Search(using = get_client(), index=index).query({
         "bool": {
           "must": [
             {
@@ -41,8 +138,8 @@ def log_query(query, start, end, index = "vltlog*"):
     df = pd.DataFrame((d.to_dict() for d in response.hits))
     return df
 
-def log_scan(query, start, end, index = "vltlog*"):
-    """ES scan to retrieve logs
+async def async_log_query(query, start, end, index = "vltlog*"):
+    """Async version of log_query, the event loop keeps running while ES answers.
 
     Args:
         query (string): what are we looking for
@@ -54,37 +151,798 @@ def log_scan(query, start, end, index = "vltlog*"):
         (pandas.DataFrame): hits of the query
 
     """
-    es = Elasticsearch("wgsdlab5")
-    scanned = scan(es,
-        query = {
-            "query":
-            {
-                "bool": {
-                  "must": [
-                    {
-                      "query_string": {
-                        "query": query,
-                        "analyze_wildcard": "true",
-                        "default_field": "*"
-                      }
-                    },
-                    {
-                      "range": {
-                        "@timestamp": {
-                          "gte": start,
-                          "lte": end,
-                        }
-                      }
+    client = get_async_client()
+    body = _scan_body(query, start, end)
+    count = await client.count(index = index, body = body)
+    response = await client.search(index = index, body = body, size = count["count"])
+    df = pd.DataFrame((hit["_source"] for hit in response["hits"]["hits"]))
+    return df
+
+def timestamps_to_datetime(values):
+    """Turns a whole column of ES timestamps into UTC datetimes. ES delivers epoch
+    millis (integers) or ISO strings, the kind is detected once for the column.
+
+    Args:
+        values (Series, list): timestamps to be converted.
+
+    Returns:
+        (Series): datetime64[ns, UTC] timestamps.
+    """
+    if not isinstance(values, pd.Series):
+        values = pd.Series(values)
+
+    if pd.api.types.is_datetime64_any_dtype(values):
+        if values.dt.tz is None:
+            return values.dt.tz_localize('UTC')
+        return values.dt.tz_convert('UTC')
+
+    if pd.api.types.is_numeric_dtype(values):
+        return pd.to_datetime(values, unit = 'ms', utc = True)
+
+    kind = pd.api.types.infer_dtype(values, skipna = True)
+    if kind == 'integer':
+        return pd.to_datetime(pd.to_numeric(values), unit = 'ms', utc = True)
+    if kind in ('mixed-integer', 'mixed-integer-float'):
+        #epoch millis and strings in the same column, each kind in its own pass
+        millis = values.map(type).isin([int, float])
+        converted = pd.Series(pd.NaT, index = values.index, dtype = 'datetime64[ns, UTC]')
+        converted[millis] = pd.to_datetime(values[millis].astype('int64'), unit = 'ms', utc = True)
+        converted[~millis] = pd.to_datetime(values[~millis], utc = True)
+        return converted
+    return pd.to_datetime(values, utc = True)
+
+
+def _collect_hits(hits, source = None):
+    """Accumulates every field of the ES hits in its own list, so the hits are not
+    kept in memory.
+
+    Args:
+        hits (iterable[dict]): ES hits.
+        source (list[string]): fields to keep, in this order. All by default.
+
+    Returns:
+        (dict, dict, int): values of every field, rows where every field was found
+            and number of hits.
+    """
+    values = {field: [] for field in source} if source else {}
+    rows = {field: [] for field in values}
+    n = 0
+    for hit in hits:
+        for field, value in hit['_source'].items():
+            if field not in values:
+                if source:
+                    continue
+                values[field] = []
+                rows[field] = []
+            values[field].append(value)
+            rows[field].append(n)
+        n += 1
+    return values, rows, n
+
+
+def _fields_to_frame(parts):
+    """Builds a DataFrame from hits collected by _collect_hits, one column at a time.
+    The timestamps are turned into datetimes and the repetitive fields into
+    categoricals.
+
+    Args:
+        parts (list[tuple]): collected hits, their rows are stacked in this order.
+
+    Returns:
+        (DataFrame): hits, one row per hit.
+    """
+    n = sum(part_n for _, _, part_n in parts)
+    if n == 0:
+        return pd.DataFrame()
+
+    fields = list(dict.fromkeys(field for part_values, _, _ in parts for field in part_values))
+    columns = dict()
+    for field in fields:
+        if len(parts) == 1:
+            values, rows = parts[0][0].pop(field), parts[0][1].pop(field)
+        else:
+            values, rows, offset = [], [], 0
+            for part_values, part_rows, part_n in parts:
+                if field in part_values:
+                    values.extend(part_values.pop(field))
+                    rows.append(np.asarray(part_rows.pop(field), dtype = int) + offset)
+                offset += part_n
+            rows = np.concatenate(rows)
+
+        if len(values) == n:
+            column = values
+        else:
+            #field missing in some hits
+            column = np.full(n, None, dtype = object)
+            column[rows] = values
+        values = rows = None
+
+        if field == '@timestamp':
+            column = timestamps_to_datetime(column).array
+        elif field in categorical_fields:
+            column = pd.Categorical(column)
+        columns[field] = column
+
+    return pd.DataFrame(columns)
+
+
+def _hits_to_frame(hits, source = None):
+    """Builds a DataFrame from ES hits, one column at a time."""
+    return _fields_to_frame([_collect_hits(hits, source)])
+
+
+def _scan_body(query, start, end, source = None):
+    """Body of a scan over the logs matching query between start and end."""
+    body = {
+        "query":
+        {
+            "bool": {
+              "must": [
+                {
+                  "query_string": {
+                    "query": query,
+                    "analyze_wildcard": "true",
+                    "default_field": "*"
+                  }
+                },
+                {
+                  "range": {
+                    "@timestamp": {
+                      "gte": start,
+                      "lte": end,
                     }
-                  ]
+                  }
                 }
+              ]
             }
-        },
+        }
+    }
+    if source:
+        body["_source"] = list(source)
+    return body
+
+
+def log_scan(query, start, end, index = "vltlog*", source = None, slices = 1, cache = False):
+    """ES scan to retrieve logs
+
+    Args:
+        query (string): what are we looking for
+        start (string, datetime): where to start the search
+        end (string, datetime): where to end the search
+        index (string): ES index where to look at.
+        source (list[string]): fields to retrieve from every log. All by default.
+        slices (int): if more than one, the scroll is split in this number of slices
+            that are downloaded concurrently, and the logs are sorted by @timestamp.
+        cache (bool): if to use the local cache. Only the parts of the time range
+            that were never scanned with this query are asked to ES, and the logs
+            are sorted by @timestamp.
+
+    Returns:
+        (pandas.DataFrame): hits of the query. @timestamp as UTC datetimes, system,
+            envname, procname and logtype as categoricals.
+
+    """
+    if cache:
+        return _cached_log_scan(query, start, end, index, source, slices)
+
+    body = _scan_body(query, start, end, source)
+
+    def scan_slice(slice_id):
+        if slices > 1:
+            body_slice = dict(body, slice = {"id": slice_id, "max": slices})
+        else:
+            body_slice = body
+        scanned = scan(get_client(),
+            query = body_slice,
+            scroll='20m',
+            size=1000,
+            index = index,
+            request_timeout = 100,
+        )
+        return _collect_hits(scanned, source)
+
+    if slices <= 1:
+        return _fields_to_frame([scan_slice(0)])
+
+    with ThreadPoolExecutor(max_workers = slices) as executor:
+        parts = list(executor.map(scan_slice, range(slices)))
+
+    res = _fields_to_frame(parts)
+    if res.empty:
+        return res
+    return res.sort_values(by = "@timestamp", kind = "mergesort").reset_index(drop = True)
+
+
+def log_scan_iter(query, start, end, index = "vltlog*", source = None, chunk_size = 10000):
+    """ES scan to retrieve logs in chunks, while they are downloaded. Only one chunk
+    is kept in memory at a time.
+
+    Args:
+        query (string): what are we looking for
+        start (string, datetime): where to start the search
+        end (string, datetime): where to end the search
+        index (string): ES index where to look at.
+        source (list[string]): fields to retrieve from every log. All by default.
+        chunk_size (int): logs per chunk.
+
+    Yields:
+        (pandas.DataFrame): chunk of hits, with the same dtypes of log_scan. Chunks
+            come in @timestamp order, and so the logs inside every chunk.
+
+    """
+    body = _scan_body(query, start, end, source)
+    body["sort"] = [{"@timestamp": "asc"}]
+    scanned = scan(get_client(),
+        query = body,
         scroll='20m',
-        size=1000,
+        size=min(chunk_size, 1000),
         index = index,
         request_timeout = 100,
+        preserve_order = True,
     )
-    
-    res = pd.DataFrame([hit['_source'] for hit in scanned])
+
+    while True:
+        chunk = _hits_to_frame(islice(scanned, chunk_size), source)
+        if chunk.empty:
+            return
+        yield chunk
+
+
+async def async_log_scan(query, start, end, index = "vltlog*", source = None, slices = 1, cache = False):
+    """Async version of log_scan, the scroll is iterated without blocking the event
+    loop. Same arguments and result of log_scan.
+
+    Args:
+        query (string): what are we looking for
+        start (string, datetime): where to start the search
+        end (string, datetime): where to end the search
+        index (string): ES index where to look at.
+        source (list[string]): fields to retrieve from every log. All by default.
+        slices (int): if more than one, the scroll is split in this number of slices
+            that are downloaded at the same time, and the logs are sorted by @timestamp.
+        cache (bool): if to use the local cache.
+
+    Returns:
+        (pandas.DataFrame): hits of the query. @timestamp as UTC datetimes, system,
+            envname, procname and logtype as categoricals.
+
+    """
+    if cache:
+        return await _async_cached_log_scan(query, start, end, index, source, slices)
+
+    body = _scan_body(query, start, end, source)
+
+    async def scan_slice(slice_id):
+        if slices > 1:
+            body_slice = dict(body, slice = {"id": slice_id, "max": slices})
+        else:
+            body_slice = body
+        scanned = async_scan(get_async_client(),
+            query = body_slice,
+            scroll='20m',
+            size=1000,
+            index = index,
+            request_timeout = 100,
+        )
+        #hits are collected a page at a time, so they are not kept in memory
+        parts, page = [], []
+        async for hit in scanned:
+            page.append(hit)
+            if len(page) == 1000:
+                parts.append(_collect_hits(page, source))
+                page = []
+        parts.append(_collect_hits(page, source))
+        return parts
+
+    if slices <= 1:
+        return _fields_to_frame(await scan_slice(0))
+
+    slice_parts = await asyncio.gather(*(scan_slice(slice_id) for slice_id in range(slices)))
+    res = _fields_to_frame([part for parts in slice_parts for part in parts])
+    if res.empty:
+        return res
+    return res.sort_values(by = "@timestamp", kind = "mergesort").reset_index(drop = True)
+
+
+def map_concurrently(function, items, max_workers = es_max_workers):
+    """Calls function with every item from a bounded pool of threads, so independent
+    queries wait for ES at the same time.
+
+    Args:
+        function (callable): function of one argument
+        items (iterable): arguments
+        max_workers (int): max of calls running at the same time
+
+    Returns:
+        (list): results in the order of items. If a call raises, it is raised here.
+    """
+    items = list(items)
+    if len(items) <= 1 or max_workers <= 1:
+        return [function(item) for item in items]
+    with ThreadPoolExecutor(max_workers = min(max_workers, len(items))) as executor:
+        return list(executor.map(function, items))
+
+
+def log_scan_many(scans, index = "vltlog*", source = None, cache = False, max_workers = es_max_workers):
+    """log_scan of many (query, start, end) at the same time, through a bounded pool of threads.
+
+    Args:
+        scans (list[(string, timestamp, timestamp)]): query, start and end of every scan
+        index (string): ES index where to look at.
+        source (list[string]): fields to retrieve from every log. All by default.
+        cache (bool): if to use the local cache.
+        max_workers (int): max of scans running at the same time.
+
+    Returns:
+        (list[pandas.DataFrame]): logs of every scan, in the order of scans.
+
+    """
+    def scan_one(scan_args):
+        query, start, end = scan_args
+        return log_scan(query, start, end, index, source = source, cache = cache)
+    return map_concurrently(scan_one, scans, max_workers)
+
+
+def coalesce_windows(windows, max_gap = es_coalesce_gap):
+    """Merges time windows that overlap or are closer than max_gap.
+
+    Args:
+        windows (list[(timestamp, timestamp)]): start and end of every window
+        max_gap (string): largest gap between two windows merged
+
+    Returns:
+        (list[(datetime, datetime)]): merged windows, sorted by start
+    """
+    windows = sorted(
+        (pd.to_datetime(start, utc = True), pd.to_datetime(end, utc = True)) for start, end in windows
+    )
+    merged = []
+    for start, end in windows:
+        if merged and start <= merged[-1][1] + pd.Timedelta(max_gap):
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def log_scan_windows(query, windows, index = "vltlog*", source = None, cache = False, max_gap = es_coalesce_gap,
+                     max_workers = es_max_workers):
+    """log_scan of many time windows with the same query. Close windows are merged
+    and scanned once, and the logs of every window are sliced from the scan. The
+    merged windows are scanned at the same time.
+
+    Args:
+        query (string or list[string]): what are we looking for, or the query of
+            every window. Windows of different queries are never merged, but all
+            of them are scanned in the same pool.
+        windows (list[(timestamp, timestamp)]): start and end of every window
+        index (string): ES index where to look at.
+        source (list[string]): fields to retrieve from every log. All by default.
+        cache (bool): if to use the local cache.
+        max_gap (string): windows closer than this are scanned together.
+        max_workers (int): max of scans running at the same time.
+
+    Returns:
+        (list[pandas.DataFrame]): logs of every window sorted by @timestamp, in the
+            order of windows.
+
+    """
+    windows = [(pd.to_datetime(start, utc = True), pd.to_datetime(end, utc = True)) for start, end in windows]
+    queries = [query] * len(windows) if isinstance(query, str) else list(query)
+    positions = dict()
+    for i, window_query in enumerate(queries):
+        positions.setdefault(window_query, []).append(i)
+
+    merged = {
+        window_query: coalesce_windows([windows[i] for i in query_positions], max_gap)
+        for window_query, query_positions in positions.items()
+    }
+    scans = log_scan_many(
+        [(window_query, start.isoformat(), end.isoformat())
+         for window_query, query_windows in merged.items() for start, end in query_windows],
+        index, source = source, cache = cache, max_workers = max_workers,
+    )
+
+    res = [None] * len(windows)
+    for window_query, query_positions in positions.items():
+        query_scans, scans = scans[:len(merged[window_query])], scans[len(merged[window_query]):]
+        query_logs = _slice_windows(query_scans, [windows[i] for i in query_positions])
+        for i, logs in zip(query_positions, query_logs):
+            res[i] = logs
+    return res
+
+
+def _slice_windows(scans, windows):
+    """Logs of every window, sliced from the scans of the merged windows."""
+    scans = [logs for logs in scans if not logs.empty]
+    if not scans:
+        return [pd.DataFrame() for _ in windows]
+
+    logs = pd.concat(scans, ignore_index = True, sort = False)
+    for field in categorical_fields:
+        if field in logs and logs[field].dtype != 'category':
+            logs[field] = logs[field].astype('category')
+    logs = logs.sort_values(by = "@timestamp", kind = "mergesort").reset_index(drop = True)
+    #merged windows do not overlap, so a log is only once in logs
+    timestamps = logs["@timestamp"].values
+    starts = np.searchsorted(timestamps, np.array([start.to_datetime64() for start, _ in windows]), side = "left")
+    ends = np.searchsorted(timestamps, np.array([end.to_datetime64() for _, end in windows]), side = "right")
+    return [logs.iloc[i:j].reset_index(drop = True) for i, j in zip(starts, ends)]
+
+
+################
+# Aggregations #
+################
+
+_aggregatable_cache = dict()
+
+def _aggregatable(field_caps, fields):
+    """ES field that can be aggregated for every field, the field itself or its
+    .keyword subfield. None if there is none.
+
+    Args:
+        field_caps (dict): response of the field capabilities API
+        fields (list[string]): fields wanted
+
+    Returns:
+        (dict): field to ES field
+    """
+    caps = field_caps.get("fields", {})
+    res = dict()
+    for field in fields:
+        res[field] = None
+        for candidate in (field, field + ".keyword"):
+            types = caps.get(candidate, {})
+            #a field mapped with many types in the indices must be aggregatable in all of them
+            if types and all(cap.get("aggregatable", False) for cap in types.values()):
+                res[field] = candidate
+                break
+    return res
+
+def aggregatable_fields(fields, index = "vltlog*"):
+    """ES fields to use to aggregate fields, asked once per index and field.
+
+    Args:
+        fields (list[string]): fields wanted
+        index (string): ES index where to look at.
+
+    Returns:
+        (dict): field to the ES field to aggregate, None if it can't be aggregated.
+    """
+    missing = [field for field in fields if (index, field) not in _aggregatable_cache]
+    if missing:
+        field_caps = get_client().field_caps(
+            index = index, fields = ",".join(missing + [field + ".keyword" for field in missing])
+        )
+        for field, es_field in _aggregatable(field_caps, missing).items():
+            _aggregatable_cache[(index, field)] = es_field
+    return {field: _aggregatable_cache[(index, field)] for field in fields}
+
+async def async_aggregatable_fields(fields, index = "vltlog*"):
+    """Async version of aggregatable_fields"""
+    missing = [field for field in fields if (index, field) not in _aggregatable_cache]
+    if missing:
+        field_caps = await get_async_client().field_caps(
+            index = index, fields = ",".join(missing + [field + ".keyword" for field in missing])
+        )
+        for field, es_field in _aggregatable(field_caps, missing).items():
+            _aggregatable_cache[(index, field)] = es_field
+    return {field: _aggregatable_cache[(index, field)] for field in fields}
+
+
+def _aggregate_body(query, start, end, keys, interval = None, offset = None, size = 1000):
+    """Body of a composite aggregation of the logs matching query between start and
+    end, by keys and optionally by time buckets of interval."""
+    body = _scan_body(query, start, end)
+    body["size"] = 0
+    sources = []
+    if interval is not None:
+        histogram = {"field": "@timestamp", "fixed_interval": interval}
+        if offset is not None:
+            histogram["offset"] = offset
+        sources.append({"@timestamp": {"date_histogram": histogram}})
+    sources += [{key: {"terms": {"field": field}}} for key, field in keys.items()]
+    body["aggs"] = {"groups": {"composite": {"size": size, "sources": sources}}}
+    return body
+
+def _buckets_to_frame(buckets, keys, interval = None):
+    """DataFrame from the buckets of a composite aggregation, one row per bucket."""
+    columns = (["@timestamp"] if interval is not None else []) + list(keys)
+    if not buckets:
+        return pd.DataFrame(columns = columns + ["count"])
+    res = pd.DataFrame({
+        column: [bucket["key"][column] for bucket in buckets] for column in columns
+    })
+    res["count"] = [bucket["doc_count"] for bucket in buckets]
+    if interval is not None:
+        res["@timestamp"] = pd.to_datetime(res["@timestamp"], unit = "ms", utc = True)
+    for field in categorical_fields:
+        if field in res:
+            res[field] = res[field].astype("category")
     return res
+
+def log_aggregate(query, start, end, keys, index = "vltlog*", interval = None, offset = None, size = 1000):
+    """ES composite aggregation: counts the logs matching query by keys, inside ES.
+    Only the counts are transferred, not the logs.
+
+    Args:
+        query (string): what are we looking for
+        start (string, datetime): where to start the search
+        end (string, datetime): where to end the search
+        keys (dict): column of the result to the ES field aggregated, see
+            aggregatable_fields.
+        index (string): ES index where to look at.
+        interval (string): if given, the logs are also counted in time buckets of
+            this size (ES fixed_interval, e.g. '300000ms').
+        offset (string): shift of the time buckets (ES offset, e.g. '+1ms').
+        size (int): buckets per request.
+
+    Returns:
+        (pandas.DataFrame): @timestamp (start of the bucket, if interval), keys and
+            count. Logs without some key are not counted.
+
+    """
+    body = _aggregate_body(query, start, end, keys, interval, offset, size)
+    buckets = []
+    while True:
+        response = get_client().search(index = index, body = body, request_timeout = 100)
+        groups = response["aggregations"]["groups"]
+        buckets += groups["buckets"]
+        if "after_key" not in groups or len(groups["buckets"]) < size:
+            break
+        body["aggs"]["groups"]["composite"]["after"] = groups["after_key"]
+    return _buckets_to_frame(buckets, keys, interval)
+
+async def async_log_aggregate(query, start, end, keys, index = "vltlog*", interval = None, offset = None,
+                              size = 1000):
+    """Async version of log_aggregate"""
+    body = _aggregate_body(query, start, end, keys, interval, offset, size)
+    buckets = []
+    while True:
+        response = await get_async_client().search(index = index, body = body, request_timeout = 100)
+        groups = response["aggregations"]["groups"]
+        buckets += groups["buckets"]
+        if "after_key" not in groups or len(groups["buckets"]) < size:
+            break
+        body["aggs"]["groups"]["composite"]["after"] = groups["after_key"]
+    return _buckets_to_frame(buckets, keys, interval)
+
+
+##############
+# Scan cache #
+##############
+
+_cache_lock = threading.Lock()
+
+def _cache_entry(query, index):
+    """Folder and coverage index of the cached scans of a query. The query is
+    normalized, so the same query written with other spacing shares the entry.
+
+    Returns:
+        (string, dict): folder of the entry and its index. The index lists the
+            chunks already fetched, each one with the time range and the fields
+            it covers (None for whole logs), and the union of the fields asked.
+    """
+    query = " ".join(query.split())
+    key = hashlib.sha1(json.dumps([query, index]).encode()).hexdigest()
+    folder = os.path.join(es_cache_folder, key)
+
+    index_file = os.path.join(folder, "index.json")
+    with _cache_lock:
+        if os.path.exists(index_file):
+            with open(index_file) as f:
+                return folder, json.load(f)
+    return folder, {"query": query, "index": index, "chunks": [], "fields": []}
+
+
+def _chunk_covers(chunk, columns):
+    """If a chunk has every column asked. Chunks of whole logs (and the ones cached
+    before fields were recorded) have them all."""
+    fields = chunk.get("fields")
+    return fields is None or (columns is not None and set(columns) <= set(fields))
+
+
+def _cache_fields(entry, columns):
+    """Fields to ask ES for the gaps of a scan: the ones asked so far on the entry
+    plus the columns asked now, so chunks keep serving the earlier scans.
+
+    Returns:
+        (list[string]): sorted fields, None for whole logs.
+    """
+    _, index = entry
+    if columns is None or index.get("fields", []) is None:
+        return None
+    return sorted(set(index.get("fields", [])) | set(columns))
+
+
+def _cache_gaps(entry, start, end, columns = None):
+    """Parts of the time range between start and end that are not cached with
+    the columns asked (all of them by default).
+
+    Returns:
+        (list[(Timestamp, Timestamp)]): uncovered time ranges, in order.
+    """
+    _, index = entry
+    covered = sorted(
+        (pd.Timestamp(chunk["start"]), pd.Timestamp(chunk["end"]))
+        for chunk in index["chunks"] if _chunk_covers(chunk, columns)
+    )
+    gaps = []
+    cursor = start
+    for chunk_start, chunk_end in covered:
+        if chunk_end < cursor:
+            continue
+        if chunk_start > end:
+            break
+        if chunk_start > cursor:
+            gaps.append((cursor, chunk_start))
+        cursor = max(cursor, chunk_end)
+    if cursor < end:
+        gaps.append((cursor, end))
+    return gaps
+
+
+def _write_chunk(frame, filename):
+    """Writes a chunk of logs as compressed parquet, dtypes included. Columns that
+    mix types (parquet can't store them) fall back to a pickle.
+
+    Returns:
+        (string): name of the file written.
+    """
+    try:
+        frame.to_parquet(filename + ".parquet", compression = "snappy", index = False)
+        return filename + ".parquet"
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        if os.path.exists(filename + ".parquet"):
+            os.remove(filename + ".parquet")
+        frame.to_pickle(filename + ".pkl")
+        return filename + ".pkl"
+
+def _read_chunk(filename, columns = None):
+    """Reads a chunk of logs, memory mapped and only the columns asked."""
+    if filename.endswith(".parquet"):
+        if columns is not None:
+            columns = [column for column in columns
+                       if column in pq.read_schema(filename, memory_map = True).names]
+        return pd.read_parquet(filename, columns = columns, memory_map = True)
+    logs = pd.read_pickle(filename)
+    if columns is not None:
+        logs = logs[[column for column in columns if column in logs.columns]]
+    return logs
+
+
+def _cache_store(entry, start, end, logs, fields = None):
+    """Stores the logs scanned between start and end with the given fields (None
+    for whole logs). The logs newer than es_cache_settle are left out of the cache.
+
+    Returns:
+        (DataFrame): logs that were not cached. They are not part of the coverage
+            index, so they are asked to ES again next time.
+    """
+    folder, index = entry
+    settled = pd.Timestamp.now(tz = 'UTC') - pd.Timedelta(es_cache_settle)
+    if start >= settled:
+        return logs
+
+    unsettled = pd.DataFrame()
+    if end > settled:
+        end = settled
+        if not logs.empty:
+            unsettled = logs[logs["@timestamp"] > end]
+            logs = logs[logs["@timestamp"] <= end]
+
+    chunk = {"start": start.isoformat(), "end": end.isoformat(), "file": None, "fields": fields}
+    #chunk files have unique names, only the index update waits for other scans
+    os.makedirs(folder, exist_ok = True)
+    if not logs.empty:
+        filename = _write_chunk(logs, os.path.join(folder, uuid.uuid4().hex))
+        chunk["file"] = os.path.basename(filename)
+    with _cache_lock:
+        #scans running at the same time may have added chunks since the index was read
+        index_file = os.path.join(folder, "index.json")
+        if os.path.exists(index_file):
+            with open(index_file) as f:
+                stored = json.load(f)
+            index["chunks"] = stored["chunks"] + [c for c in index["chunks"] if c not in stored["chunks"]]
+            index["fields"] = _cache_fields((folder, stored), index.get("fields", []))
+        index["chunks"].append(chunk)
+        index["fields"] = _cache_fields(entry, fields)
+        #written aside and renamed, a half written index is never read
+        with open(index_file + ".tmp", "w") as f:
+            json.dump(index, f)
+        os.replace(index_file + ".tmp", index_file)
+    return unsettled
+
+
+def _cache_load(entry, start, end, unsettled = (), columns = None):
+    """Stitches the cached logs between start and end, plus the logs that could not
+    be cached. A log at the border of two chunks is in both, it is kept once.
+    Only the given columns are read (all of them by default), from the chunks
+    that have them.
+
+    Returns:
+        (DataFrame): logs sorted by @timestamp.
+    """
+    folder, index = entry
+    chunks = sorted(
+        (pd.Timestamp(chunk["start"]), pd.Timestamp(chunk["end"]), chunk["file"])
+        for chunk in index["chunks"] if _chunk_covers(chunk, columns)
+    )
+    parts = []
+    last_end = None
+    for chunk_start, chunk_end, filename in chunks:
+        if chunk_end < start or chunk_start > end:
+            continue
+        if filename is not None:
+            logs = _read_chunk(os.path.join(folder, filename), columns)
+            logs = logs[(logs["@timestamp"] >= start) & (logs["@timestamp"] <= end)]
+            if last_end is not None and chunk_start <= last_end:
+                logs = logs[logs["@timestamp"] > last_end]
+            parts.append(logs)
+        last_end = chunk_end if last_end is None else max(last_end, chunk_end)
+    for logs in unsettled:
+        if last_end is not None and not logs.empty:
+            logs = logs[logs["@timestamp"] > last_end]
+        parts.append(logs)
+    parts = [logs for logs in parts if not logs.empty]
+
+    if not parts:
+        return pd.DataFrame()
+    res = pd.concat(parts, ignore_index = True, sort = False)
+    for field in categorical_fields:
+        if field in res and res[field].dtype != 'category':
+            res[field] = res[field].astype('category')
+    return res.sort_values(by = "@timestamp", kind = "mergesort").reset_index(drop = True)
+
+
+def _cached_log_scan(query, start, end, index, source, slices):
+    """log_scan through the local cache, ES only gets the uncovered time ranges.
+    Gaps are scanned with the fields asked so far on the query, not whole logs."""
+    start = pd.to_datetime(start, utc = True)
+    end = pd.to_datetime(end, utc = True)
+    columns = None
+    if source:
+        columns = list(source) + (["@timestamp"] if "@timestamp" not in source else [])
+
+    entry = _cache_entry(query, index)
+    fields = _cache_fields(entry, columns)
+    unsettled = []
+    for gap_start, gap_end in _cache_gaps(entry, start, end, columns):
+        logs = log_scan(query, gap_start.isoformat(), gap_end.isoformat(), index, source = fields, slices = slices)
+        logs = _cache_store(entry, gap_start, gap_end, logs, fields)
+        if columns is not None and not logs.empty:
+            logs = logs[[column for column in columns if column in logs.columns]]
+        unsettled.append(logs)
+    return _cache_load(entry, start, end, unsettled, columns)
+
+
+async def _async_cached_log_scan(query, start, end, index, source, slices):
+    """async_log_scan through the local cache. The uncovered time ranges are asked
+    to ES at the same time, the files are read and written in a thread."""
+    start = pd.to_datetime(start, utc = True)
+    end = pd.to_datetime(end, utc = True)
+    columns = None
+    if source:
+        columns = list(source) + (["@timestamp"] if "@timestamp" not in source else [])
+
+    loop = asyncio.get_event_loop()
+    entry = _cache_entry(query, index)
+    fields = _cache_fields(entry, columns)
+    gaps = _cache_gaps(entry, start, end, columns)
+    scanned = await asyncio.gather(*(
+        async_log_scan(query, gap_start.isoformat(), gap_end.isoformat(), index, source = fields, slices = slices)
+        for gap_start, gap_end in gaps
+    ))
+    unsettled = []
+    for (gap_start, gap_end), logs in zip(gaps, scanned):
+        logs = await loop.run_in_executor(None, _cache_store, entry, gap_start, gap_end, logs, fields)
+        if columns is not None and not logs.empty:
+            logs = logs[[column for column in columns if column in logs.columns]]
+        unsettled.append(logs)
+    return await loop.run_in_executor(None, _cache_load, entry, start, end, unsettled, columns)
+
+
+def clear_scan_cache():
+    """Deletes every cached scan."""
+    with _cache_lock:
+        shutil.rmtree(es_cache_folder, ignore_errors = True)
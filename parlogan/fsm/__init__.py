@@ -0,0 +1 @@
+from .fsm import *
@@ -0,0 +1,3 @@
+import pandas as pd
+import numpy as np
+import networkx as nx
@@ -0,0 +1,234 @@
+from .config import *
+
+
+class LogFSM:
+    """State machine that segments a sequence of logs into executions, declared as a graph.
+
+    Every node of the graph is a state, and can have these attributes:
+        filter: the state is reached, from any state with an edge to it, by a log containing it
+        opens: reaching the state starts an execution. If one was running, it ends with no end
+        closes: reaching the state ends the running execution
+        priority: when a log reaches many states at once, the highest priority wins
+
+    Logs are classified by the filters they contain (a bit for each filter) all at once, and
+    only the logs matching some filter of the successors of the current state are walked.
+    The next state of a state and class of log is resolved once, over the successor bits of
+    that state only, and remembered in its table.
+
+    Attributes:
+        states: name of every state
+        filters: filter of every bit of the classes of logs
+        successors: bits of the filters of the successors of every state
+        table: next state of every state by the classes of logs seen (masked by its
+            successors), -2 if many states could be reached (a ValueError when a log gets there)
+        state: current state, kept between calls of stream
+    """
+
+    def __init__(self, H, start = "_Start_"):
+        self.graph = H
+        self.states = list(H.nodes)
+        targets = [i for i, state in enumerate(self.states) if 'filter' in H.nodes[state]]
+        self.filters = [H.nodes[self.states[i]]['filter'] for i in targets]
+        self.opens = [H.nodes[state].get('opens', False) for state in self.states]
+        self.closes = [H.nodes[state].get('closes', False) for state in self.states]
+        priority = [H.nodes[state].get('priority', 0) for state in self.states]
+        
+        self.targets = targets
+        self.priority = priority
+        self.next_bits = []
+        self.successors = []
+        for state in self.states:
+            next_bits = [targets.index(self.states.index(b)) for b in H.successors(state) if 'filter' in H.nodes[b]]
+            #a log reaching a state also reaches the ones with a filter inside its own,
+            #if none of them has a higher priority the graph can't tell where to go
+            for bit in next_bits:
+                clash = [
+                    other for other in next_bits if other != bit
+                    and self.filters[other] in self.filters[bit]
+                    and priority[targets[other]] == priority[targets[bit]]
+                ]
+                if clash:
+                    raise ValueError("From %s the filter of %s reaches many states: %s" % (
+                        state, self.states[targets[bit]], [self.states[targets[b]] for b in [bit] + clash]
+                    ))
+            self.next_bits.append(next_bits)
+            self.successors.append(sum(1 << bit for bit in next_bits))
+        self.table = [dict() for _ in self.states]
+        self.start = self.states.index(start)
+        self.reset()
+
+    def reset(self):
+        """Back to the initial state, forgetting the running execution."""
+        self.state = self.start
+        self.running = None
+        self.offset = 0
+
+    def classify(self, logtext):
+        """Class of every log: a bit for each filter it contains. Repeated logs are classified once."""
+        codes, uniques = pd.factorize(pd.Series(logtext).astype(str))
+        uniques = pd.Series(uniques)
+        #python ints when the bits don't fit in int64
+        dtype = np.int64 if len(self.filters) < 63 else object
+        masks = np.zeros(len(uniques) + 1, dtype = dtype)
+        for bit, log_filter in enumerate(self.filters):
+            masks[:-1] |= uniques.str.contains(log_filter, regex = False).values.astype(dtype) << bit
+        #missing logs (code -1) match nothing
+        return masks[codes]
+
+    def _candidates(self, state, mask):
+        """States with the highest priority a log of class mask could reach from state"""
+        NS = [self.targets[bit] for bit in self.next_bits[state] if mask >> bit & 1]
+        top = max(self.priority[b] for b in NS)
+        return [b for b in NS if self.priority[b] == top]
+
+    def next_state(self, state, mask):
+        """State reached from state by a log of class mask, -1 if there is no transition and
+        -2 if many states could be reached."""
+        mask &= self.successors[state]
+        if not mask:
+            return -1
+        NS = self.table[state].get(mask)
+        if NS is None:
+            NS = self._candidates(state, mask)
+            NS = NS[0] if len(NS) == 1 else -2
+            self.table[state][mask] = NS
+        return NS
+
+    def transitions(self, logtext, state = None):
+        """Walks the state machine over the logs.
+
+        Args:
+            logtext (Series): text of the logs, in order
+            state (int): state to start from. Defaults to the initial state.
+
+        Returns:
+            (list[(int, int)]): position of the log and new state, of every transition
+
+        Raises:
+            ValueError: if a log reaches many states with the same priority.
+        """
+        state = self.start if state is None else state
+        masks = self.classify(logtext)
+        rows = np.flatnonzero(masks)
+        
+        transitions = []
+        for row, mask in zip(rows.tolist(), masks[rows].tolist()):
+            NS = self.next_state(state, mask)
+            if NS == -1:
+                continue
+            # I have several goal states, this shouldn't happen!
+            if NS == -2:
+                raise ValueError("Log %d reaches many states from %s: %s" % (
+                    row, self.states[state], [self.states[b] for b in self._candidates(state, mask)]
+                ))
+            state = NS
+            transitions.append((row, state))
+        return transitions
+
+    def intervals(self, transitions, timestamps, running = None, offset = 0):
+        """Executions given by the transitions.
+
+        Args:
+            transitions (list[(int, int)]): given by transitions
+            timestamps (Series): timestamp of every log
+            running ((int, timestamp)): position and timestamp of the log that started the running execution
+            offset (int): position of the first log, when logs come in chunks
+
+        Returns:
+            (DataFrame, (int, timestamp)): executions finished, and the one still running (or None)
+        """
+        #positions inside these logs, -1 is the log that started the running execution
+        starts, ends, states = [], [], []
+        start = None if running is None else -1
+        for row, state in transitions:
+            if self.opens[state]:
+                if start is not None:
+                    #there is no end, the new execution ends it
+                    starts.append(start)
+                    ends.append(row)
+                    states.append(None)
+                start = row
+            elif self.closes[state] and start is not None:
+                starts.append(start)
+                ends.append(row)
+                states.append(self.states[state])
+                start = None
+        
+        if running is not None:
+            timestamps = pd.concat([pd.Series([running[1]]), timestamps], ignore_index = True)
+            positions = np.r_[running[0], offset + np.arange(len(timestamps) - 1)]
+        else:
+            positions = offset + np.arange(len(timestamps))
+        shift = 1 if running is not None else 0
+        starts = np.array(starts, dtype = np.int64) + shift
+        ends = np.array(ends, dtype = np.int64) + shift
+        executions = pd.DataFrame({
+            "start_row": positions[starts],
+            "start": timestamps.iloc[starts].reset_index(drop = True),
+            "end_row": positions[ends],
+            "end": timestamps.iloc[ends].reset_index(drop = True),
+            "state": pd.Series(states, dtype = object),
+            "no_end": np.array([state is None for state in states], dtype = bool),
+        })
+        if start is not None:
+            running = (positions[start + shift], timestamps.iloc[start + shift])
+        else:
+            running = None
+        return executions, running
+
+    def executions(self, logs, text_column = 'logtext', time_column = '@timestamp'):
+        """Executions found in the logs. The one still running at the end is left out.
+
+        Args:
+            logs (DataFrame): logs sorted by time
+            text_column (string): column with the text the filters look for
+            time_column (string): column with the timestamps
+
+        Returns:
+            (DataFrame): position and timestamp of the logs starting and ending every execution,
+            state that ended it (None if it has no end) and if it has no end.
+        """
+        transitions = self.transitions(logs[text_column])
+        return self.intervals(transitions, logs[time_column].reset_index(drop = True))[0]
+
+    def stream(self, chunks, text_column = 'logtext', time_column = '@timestamp'):
+        """Like executions, for logs coming in chunks (e.g. from log_scan_iter). The state and
+        the running execution go from one chunk to the next, and positions count all the logs.
+
+        Args:
+            chunks (iterable[DataFrame]): logs sorted by time
+
+        Yields:
+            (DataFrame): executions finished in every chunk
+        """
+        self.reset()
+        for chunk in chunks:
+            transitions = self.transitions(chunk[text_column], self.state)
+            if transitions:
+                self.state = transitions[-1][1]
+            finished, self.running = self.intervals(
+                transitions, chunk[time_column].reset_index(drop = True), self.running, self.offset
+            )
+            self.offset += len(chunk)
+            yield finished
+
+
+#state machines already compiled, by the contents of their graph
+_compiled_fsms = dict()
+
+def compiled_fsm(H, start = "_Start_"):
+    """LogFSM of the graph, compiled once for every graph with the same states, attributes
+    and edges. The machine is shared: use its executions, transitions and intervals, and a
+    LogFSM of your own for stream.
+
+    Returns:
+        (LogFSM): state machine of the graph
+    """
+    key = (
+        tuple((state, tuple(sorted(attributes.items()))) for state, attributes in H.nodes(data = True)),
+        tuple(H.edges),
+        start,
+    )
+    if key not in _compiled_fsms:
+        _compiled_fsms[key] = LogFSM(H, start)
+    return _compiled_fsms[key]
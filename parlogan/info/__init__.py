@@ -1 +1,2 @@
-from .info import *
\ No newline at end of file
+from .info import *
+from .cube import *
\ No newline at end of file
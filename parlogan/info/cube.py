@@ -0,0 +1,216 @@
+import pandas as pd
+import os
+import re
+import shutil
+from fnmatch import fnmatchcase
+from parlogan.db.es import EmptyElasticQuery, Error, es_cache_settle, map_concurrently
+from parlogan import package_directory
+from .info import error_counting, error_window
+
+#local cube of error counts, one parquet file per UTC day
+error_cube_folder = os.path.join(package_directory, 'cache', 'error_cube')
+error_cube_keys = ["errkey", "system", "envname", "hostname", "loghost", "module"]
+error_cube_resolution = '1 min'
+
+def _cube_file(day):
+    return os.path.join(error_cube_folder, day.strftime('%Y-%m-%d') + '.parquet')
+
+
+def _count_day(day):
+    """Error counts of a whole day, by minute and every key of the cube. The day
+    goes from midnight (not included) to the next midnight (included), so every
+    minute bucket belongs to one day.
+    """
+    try:
+        counts = error_counting(
+            start = day,
+            end = day + pd.Timedelta('1 day'),
+            delta = error_cube_resolution,
+            group_keys = error_cube_keys,
+            aggregate = True
+        )
+    except EmptyElasticQuery:
+        counts = None
+    if counts is None or counts.empty:
+        counts = pd.DataFrame({
+            "@timestamp": pd.Series([], dtype = 'datetime64[ns, UTC]'),
+            **{key: pd.Categorical([]) for key in error_cube_keys},
+            "count": pd.Series([], dtype = 'int64'),
+        })
+    for key in error_cube_keys:
+        counts[key] = counts[key].astype(str).astype('category')
+    return counts
+
+
+def build_error_cube(start, end):
+    """Counts the errors of every day between start and end that is not in the
+    cube yet. Days still running (newer than es_cache_settle) are not stored.
+
+    Args:
+        start (timestamp): first day
+        end (timestamp): last day
+
+    Returns:
+        (list[Timestamp]): days added to the cube
+    """
+    start = pd.to_datetime(start, utc = True).floor('D')
+    end = pd.to_datetime(end, utc = True).floor('D')
+    settled = pd.Timestamp.now(tz = 'UTC') - pd.Timedelta(es_cache_settle)
+    days = [
+        day for day in pd.date_range(start, end, freq = 'D')
+        if day + pd.Timedelta('1 day') <= settled and not os.path.exists(_cube_file(day))
+    ]
+    if not days:
+        return []
+
+    os.makedirs(error_cube_folder, exist_ok = True)
+    def store_day(day):
+        counts = _count_day(day)
+        #written aside and renamed, a half written day is never read
+        tmp_file = _cube_file(day) + '.tmp'
+        counts.to_parquet(tmp_file, compression = 'snappy', index = False)
+        os.replace(tmp_file, _cube_file(day))
+    map_concurrently(store_day, days)
+    return days
+
+
+def cube_days():
+    """Days already in the cube, sorted"""
+    if not os.path.isdir(error_cube_folder):
+        return []
+    return sorted(
+        pd.Timestamp(filename[:-len('.parquet')], tz = 'UTC')
+        for filename in os.listdir(error_cube_folder) if filename.endswith('.parquet')
+    )
+
+
+#terms the cube can match: words with * and ? wildcards, any of them matches (OR)
+cube_term_regex = re.compile(r'^[\w*?][\w.*?-]*$')
+
+def _cube_terms(pattern):
+    """Lowercased terms of a kibana-like pattern, None if the pattern uses syntax
+    the cube does not reproduce (AND, NOT, quoted phrases, fields, regex, ...)."""
+    terms = [term for term in pattern.replace('(', ' ').replace(')', ' ').split() if term != 'OR']
+    if any(term in ('AND', 'NOT') or not cube_term_regex.match(term) for term in terms):
+        return None
+    return [term.lower() for term in terms]
+
+
+def _matching(column, pattern):
+    """Rows of column matching a kibana-like pattern: terms separated by spaces or
+    OR, with * and ? wildcards, any of them matches. Case insensitive like ES.
+
+    Raises:
+        ValueError: if the pattern can't be reproduced on the cube.
+    """
+    terms = _cube_terms(pattern)
+    if terms is None:
+        raise ValueError("The error cube can't match the pattern %r" % pattern)
+    if not terms or '*' in terms:
+        return pd.Series(True, index = column.index)
+    categories = column.cat.categories
+    matched = [category for category in categories
+               if any(fnmatchcase(str(category).lower(), term) for term in terms)]
+    return column.isin(matched)
+
+
+def error_cube(start, end, system = '*', envname = '*', hostname = '*', loghost = '*', module = '*',
+               build = True):
+    """Error counts per minute between start and end from the cube. The minute of
+    a count is its end, counts ending after start and up to end are returned.
+    The part of the range not settled yet is counted from ES and not stored.
+
+    Args:
+        start (timestamp): where to start to look for errors.
+        end (timestamp): where to stop looking for errors.
+        system, envname, hostname, loghost, module (string): kibana-like patterns
+            of the errors wanted, terms with wildcards separated by spaces or OR.
+            All by default.
+        build (bool): if to count the days not in the cube yet.
+
+    Returns:
+        (DataFrame): @timestamp, errkey, system, envname, hostname, loghost, module
+            and count.
+
+    Raises:
+        ValueError: if a pattern uses syntax the cube can't reproduce.
+    """
+    filters = dict(system = system, envname = envname, hostname = hostname, loghost = loghost, module = module)
+    for pattern in filters.values():
+        if _cube_terms(pattern) is None:
+            raise ValueError("The error cube can't match the pattern %r" % pattern)
+
+    start = pd.to_datetime(start, utc = True)
+    end = pd.to_datetime(end, utc = True)
+    #the day of a minute is the day of its start
+    first_day = start.floor('D')
+    last_day = (end - pd.Timedelta('1 ns')).floor('D')
+    if build:
+        build_error_cube(first_day, last_day)
+
+    parts = []
+    stored = set(cube_days())
+    for day in pd.date_range(first_day, last_day, freq = 'D'):
+        if day in stored:
+            counts = pd.read_parquet(_cube_file(day), memory_map = True)
+        elif build:
+            #still running
+            counts = _count_day(day)
+        else:
+            continue
+        counts = counts[(counts["@timestamp"] > start) & (counts["@timestamp"] <= end)]
+        for key, pattern in filters.items():
+            counts = counts[_matching(counts[key], pattern)]
+        parts.append(counts)
+
+    parts = [counts for counts in parts if not counts.empty]
+    if not parts:
+        return pd.DataFrame(columns = ["@timestamp"] + error_cube_keys + ["count"])
+    counts = pd.concat(parts, ignore_index = True, sort = False)
+    for key in error_cube_keys:
+        counts[key] = counts[key].astype('category')
+    return counts
+
+
+def cube_error_counting(system = '*', envname = '*', hostname = '*', loghost = '*', module = '*',
+                        date = None, time_back = '20 minutes',
+                        delta = '5 min', start = None, end = None,
+                        group_keys = ["errkey", "system", "envname", "hostname", "loghost", "module"],
+                        group_by_time = True, build = True):
+    """error_counting answered from the error cube, by rollup of the minute counts.
+    Same arguments and result of error_counting (filter_query is not supported),
+    delta must be a whole number of minutes. Windows are rounded to the minute.
+    Patterns the cube can't reproduce (AND, NOT, quoted phrases...) are counted
+    by ES.
+
+    Returns:
+        (DataFrame): Error Counting
+    """
+    patterns = [system, envname, hostname, loghost, module]
+    if any(_cube_terms(pattern) is None for pattern in patterns):
+        return error_counting(system, envname, hostname, loghost, module, date = date, time_back = time_back,
+                              delta = delta, start = start, end = end, group_keys = group_keys,
+                              group_by_time = group_by_time, aggregate = True)
+
+    window = error_window(date, time_back, start, end)
+    if window is None:
+        return
+    start, end = window
+
+    counts = error_cube(start, end, system, envname, hostname, loghost, module, build = build)
+    if counts.empty:
+        error_message = "\nError cube: " + system + "\nDate range: " + str(start) + " to " + str(end)
+        raise EmptyElasticQuery(Error(error_message))
+
+    if group_by_time:
+        counts = counts.groupby([
+            pd.Grouper(key='@timestamp',freq = delta, base = end.minute, closed = "right", label = "right")
+        ] + group_keys, observed = True)['count'].sum()
+    else:
+        counts = counts.groupby(group_keys, observed = True)['count'].sum()
+    return counts[counts > 0].reset_index(name = 'count')
+
+
+def clear_error_cube():
+    """Deletes the error cube"""
+    shutil.rmtree(error_cube_folder, ignore_errors = True)
@@ -1,13 +1,20 @@
 import pandas as pd
+import numpy as np
+import re
 pd.options.mode.chained_assignment = None
-from parlogan.db.es import log_scan, EmptyElasticQuery, Error
-from parlogan import format_to_datetime
+from parlogan.db.es import log_scan, async_log_scan, EmptyElasticQuery, Error
+from parlogan.db.es import log_aggregate, async_log_aggregate, aggregatable_fields, async_aggregatable_fields
+from parlogan import format_series_to_datetime
+
+#fields of the errors needed to count them
+error_fields = ["@timestamp", "system", "envname", "hostname", "loghost", "module", "logtext"]
+errkey_regex = re.compile(r'(?P<errkey>[\w]*ERR_[^\s]*) : .*')
 
 def error_counting(system = '*', envname = '*', hostname = '*', loghost = '*', module = '*',
-                   filter_query = None, date = pd.datetime.now(), time_back = '20 minutes',
+                   filter_query = None, date = None, time_back = '20 minutes',
                    delta = '5 min', start = None, end = None, 
                    group_keys = ["errkey", "system", "envname", "hostname", "loghost", "module"],
-                   group_by_time = True):
+                   group_by_time = True, aggregate = False):
     """Calculates error frequency given the keys and deltatimes to group errors.
 
     Args:
@@ -17,21 +24,84 @@ def error_counting(system = '*', envname = '*', hostname = '*', loghost = '*', m
         loghost (string): loghost where to look for errors. All by default.
         module (string): module where to look for errors. All by default.
         filter_query (string): kibana query. If it is set, all arguments above are ignored.
-        date (timestamp): datetime where to look back for errors.
+        date (timestamp): datetime where to look back for errors. Now by default.
         time_back (string): how much time to look back for errors.
         delta (string): every how much time errors are counted.
         start (timestamp): where to start to look for errors.
         end (timestamp): where to stop looking for errors.
         group_keys (list[string]): keys of logs to group errors for
         group_by_time (bool): if to group by time (with the delta argument) or not
+        aggregate (bool): if to count the errors inside ES, only the counts are
+            transferred. If some group key is not indexed, or delta does not
+            divide a day, errors are counted here.
 
     Returns:
         (DataFrame): Error Counting
     """
     
+    window = error_window(date, time_back, start, end)
+    if window is None:
+        return
+    start, end = window
+    query = error_query(system, envname, hostname, loghost, module, filter_query)
+    
+    if aggregate:
+        keys = aggregatable_fields(group_keys)
+        args = aggregation_args(start, end, delta, group_by_time)
+        if all(keys.values()) and args is not None:
+            agg_start, interval, offset = args
+            counts = log_aggregate(query, agg_start, end, keys, interval = interval, offset = offset)
+            return aggregated_errors(counts, query, start, end, delta, group_keys, group_by_time)
+        #some key is not indexed or delta does not divide a day, errors are counted here
+        
+    errors = log_scan(
+        query,
+        start,
+        end,
+        source = error_fields,
+    )
+    return count_errors(errors, query, start, end, delta, group_keys, group_by_time)
+
+
+async def async_error_counting(system = '*', envname = '*', hostname = '*', loghost = '*', module = '*',
+                               filter_query = None, date = None, time_back = '20 minutes',
+                               delta = '5 min', start = None, end = None,
+                               group_keys = ["errkey", "system", "envname", "hostname", "loghost", "module"],
+                               group_by_time = True, aggregate = False):
+    """Async version of error_counting, same arguments and result."""
+    window = error_window(date, time_back, start, end)
+    if window is None:
+        return
+    start, end = window
+    query = error_query(system, envname, hostname, loghost, module, filter_query)
+    
+    if aggregate:
+        keys = await async_aggregatable_fields(group_keys)
+        args = aggregation_args(start, end, delta, group_by_time)
+        if all(keys.values()) and args is not None:
+            agg_start, interval, offset = args
+            counts = await async_log_aggregate(query, agg_start, end, keys, interval = interval, offset = offset)
+            return aggregated_errors(counts, query, start, end, delta, group_keys, group_by_time)
+        
+    errors = await async_log_scan(
+        query,
+        start,
+        end,
+        source = error_fields,
+    )
+    return count_errors(errors, query, start, end, delta, group_keys, group_by_time)
+
+
+def error_window(date, time_back, start, end):
+    """Time window where errors are counted: between start and end, or time_back
+    before date (now if None).
+
+    Returns:
+        (Timestamp, Timestamp): start and end. None if only end is missing.
+    """
     #Check if a start and end is given
     if start == None and end == None:
-        end = pd.to_datetime(date, utc=True)    
+        end = pd.Timestamp.now(tz = 'UTC') if date is None else pd.to_datetime(date, utc=True)
         start = end - pd.Timedelta(time_back)
         
     elif start == None:
@@ -40,32 +110,79 @@ def error_counting(system = '*', envname = '*', hostname = '*', loghost = '*', m
     else:
         end = pd.to_datetime(end, utc=True)
         start = pd.to_datetime(start, utc=True)
-    
-    #query
+    return start, end
+
+
+def error_query(system = '*', envname = '*', hostname = '*', loghost = '*', module = '*', filter_query = None):
+    """Kibana query of the errors. filter_query wins over the other arguments."""
     if not filter_query:
         query = "*ERR_* AND system: (%s) AND envname: (%s) AND hostname: (%s) AND loghost: (%s)"\
                     " AND module: (%s)" % (system, envname, hostname, loghost, module)
     else:
         query = filter_query
-        
-    errors = log_scan(
-        query,
-        start,
-        end,
+    return query
+
+
+def parse_errkeys(logtext):
+    """Error key of every log, as in "XXX_ERR_YYY : text". Every distinct head of
+    the logs (the text before " : ") is parsed once: a head without spaces, with
+    only word characters before ERR_, is the key itself. Only the other heads
+    are searched with errkey_regex.
+
+    Args:
+        logtext (Series): logtext of the errors
+
+    Returns:
+        (Series): categorical errkey, NaN where there is none. Same index of logtext.
+    """
+    head_codes, heads = pd.factorize(
+        [text.partition(' : ')[0] if ' : ' in text else None for text in logtext.astype(str)]
     )
-            
+    keys = []
+    for head in heads:
+        prefix, found, _ = head.partition('ERR_')
+        if found and (not prefix or prefix.replace('_', '').isalnum()) and head.split() == [head]:
+            keys.append(head)
+        else:
+            keys.append(None)
+
+    #heads the fast path can't tell, the whole log is searched
+    slow = np.flatnonzero(np.isin(head_codes, [code for code, key in enumerate(keys) if key is None]))
+    errkeys = pd.Series(np.array(keys + [None], dtype = object)[head_codes], index = logtext.index)
+    if len(slow):
+        slow_texts = logtext.iloc[slow].astype(str)
+        text_codes, texts = pd.factorize(slow_texts)
+        found = [errkey_regex.search(text) for text in texts]
+        errkeys.iloc[slow] = np.array([m.group('errkey') if m else None for m in found] + [None],
+                                      dtype = object)[text_codes]
+    return errkeys.astype(pd.CategoricalDtype(sorted(errkeys.dropna().unique())))
+
+
+def count_errors(errors, query, start, end, delta = '5 min',
+                 group_keys = ["errkey", "system", "envname", "hostname", "loghost", "module"],
+                 group_by_time = True):
+    """Counts the errors found by query between start and end.
+
+    Args:
+        errors (DataFrame): logs found by query
+        query (string): query used, for the error message
+        start (Timestamp): start of the window
+        end (Timestamp): end of the window
+        delta, group_keys, group_by_time: as in error_counting
+
+    Returns:
+        (DataFrame): Error Counting
+    """
     if errors.empty:
         error_message = "\nQuery: " + query + "\nDate range: " + str(start) + " to " + str(end)
         raise EmptyElasticQuery(Error(error_message))
     
-    errors["@timestamp"] = errors["@timestamp"].apply(format_to_datetime)
+    errors = errors[[field for field in error_fields if field in errors]]
+    errors["@timestamp"] = format_series_to_datetime(errors["@timestamp"])
     errors = errors[(errors['@timestamp'] > start) & (errors['@timestamp'] <= end)]
     
-    error_keys = errors.logtext.str.extract(r'(?P<errkey>[A-Z0-9]+[A-Z0-9/. ]*)')
-    #splitted_logtext = errors.logtext.str.split(pat=":", n = 1, expand = True)
-    #errors["errkey"] = splitted_logtext[0].str.strip()
-    errors["errkey"] = errors.logtext.str.extract(r'(?P<errkey>[\w]*ERR_[^\s]*) : .*')
-    errors.dropna(inplace = True)
+    errors["errkey"] = parse_errkeys(errors["logtext"])
+    errors = errors.drop(columns = ["logtext"]).dropna()
     errors = errors.sort_values(by=["@timestamp", "errkey"])
     
     errors = errors[["@timestamp","system","envname","hostname","loghost","module","errkey"]]
@@ -73,8 +190,52 @@ def error_counting(system = '*', envname = '*', hostname = '*', loghost = '*', m
     if group_by_time:
         counts = errors.groupby([
             pd.Grouper(key='@timestamp',freq = delta, base = end.minute, closed = "right", label = "right")
-        ] + group_keys).size().reset_index(name='count')
+        ] + group_keys, observed = True).size().reset_index(name='count')
     else:
-        counts = errors.groupby(group_keys).size().reset_index(name='count')
+        counts = errors.groupby(group_keys, observed = True).size().reset_index(name='count')
     
     return counts
+
+
+def aggregation_args(start, end, delta = '5 min', group_by_time = True):
+    """log_aggregate arguments giving the same groups of count_errors. Time buckets
+    are closed on the right, like the pd.Grouper of count_errors: ES buckets
+    start 1 ms after the edges, and the logs at start are left out.
+    ES buckets are aligned to the epoch and the ones of pd.Grouper to the day of
+    the first error, they only match when delta divides a day.
+
+    Returns:
+        (Timestamp, string, string): start, interval and offset. None if ES can't
+            give the same buckets.
+    """
+    start = start + pd.Timedelta('1 ms')
+    if not group_by_time:
+        return start, None, None
+    if pd.Timedelta('1 day') % pd.Timedelta(delta) != pd.Timedelta(0):
+        return None
+    freq = pd.tseries.frequencies.to_offset(delta)
+    #pd.Grouper shifts the bins by base units of the frequency
+    unit = freq.nanos // freq.n
+    offset = (end.minute * unit) % freq.nanos
+    return start, "%dms" % (freq.nanos // 10**6), "+%dms" % (offset // 10**6 + 1)
+
+
+def aggregated_errors(counts, query, start, end, delta = '5 min',
+                      group_keys = ["errkey", "system", "envname", "hostname", "loghost", "module"],
+                      group_by_time = True):
+    """Error Counting from the counts of log_aggregate, with the columns and order
+    of count_errors.
+
+    Returns:
+        (DataFrame): Error Counting
+    """
+    if counts.empty:
+        error_message = "\nQuery: " + query + "\nDate range: " + str(start) + " to " + str(end)
+        raise EmptyElasticQuery(Error(error_message))
+    
+    columns = list(group_keys)
+    if group_by_time:
+        #buckets are labeled on the right, like pd.Grouper
+        counts["@timestamp"] = counts["@timestamp"] + pd.Timedelta(delta) - pd.Timedelta('1 ms')
+        columns = ["@timestamp"] + columns
+    return counts.sort_values(by = columns).reset_index(drop = True)[columns + ["count"]]
@@ -7,15 +7,59 @@ import os
 import numpy as np
 
 
+class SymbolVocabulary:
+    """Maps symbols (colorized logs) to int32 ids, so sequences of logs can be
+    handled as arrays of integers.
+
+    Attributes:
+        symbols: symbol of every id
+    """
+
+    def __init__(self, symbols = ()):
+        self.symbols = []
+        self.index = pd.Index([], dtype = object)
+        self.add(symbols)
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def add(self, symbols):
+        """Gives an id to every symbol not in the vocabulary yet."""
+        if not isinstance(symbols, (np.ndarray, pd.Series, pd.Index)):
+            symbols = list(symbols)
+        symbols = pd.unique(np.asarray(symbols, dtype = object))
+        new = symbols[self.index.get_indexer(symbols) == -1]
+        if len(new):
+            self.symbols.extend(new)
+            self.index = pd.Index(self.symbols, dtype = object)
+
+    def encode(self, symbols):
+        """Ids of the symbols, -1 if the symbol is not in the vocabulary.
+
+        Args:
+            symbols (array-like): symbols
+
+        Returns:
+            (ndarray): int32 ids
+        """
+        return self.index.get_indexer(np.asarray(symbols, dtype = object)).astype(np.int32)
+
+    def decode(self, ids):
+        """Symbols of the ids."""
+        return np.asarray(self.symbols, dtype = object)[np.asarray(ids, dtype = int)]
+
+
 class CommonLogs:
     """Class for the common log algorithm.
 
     Attributes:
         model: trained model
+        vocabulary: ids of the symbols seen in training
     """
     
     def __init__(self):
         self.model = None
+        self.vocabulary = SymbolVocabulary()
     
     def is_trained(self):
         """Returns if there is a trained model. """
@@ -23,93 +67,220 @@ class CommonLogs:
     
     def preprocess_dataset(self, dataset):
         """Delivers a preprocessed dataset. If the dataset has an incorrect format, it returns False.
+        Symbols not seen before are added to the vocabulary.
+
+        Args:
+            dataset (DataFrame): dataframe with sequences of logs.
+
+        Returns:
+            (list[ndarray], Bool): Sequences of symbol ids or False.
+        """
+        dataset = self.preprocess_dataset_flat(dataset)
+        if dataset is False:
+            return False
+        ids, offsets = dataset
+        return np.split(ids, offsets[1:-1])
+
+    def preprocess_dataset_flat(self, dataset):
+        """Like preprocess_dataset, but the sequences come in a flat (CSR) layout: the ids of
+        all the sequences one after the other, and the offset where every sequence starts.
 
         Args:
             dataset (DataFrame): dataframe with sequences of logs.
 
         Returns:
-            (DataFrame, Bool): Preprocessed dataset or False.
+            ((ndarray, ndarray), Bool): symbol ids and offsets (one more than sequences) or False.
         """
         if isinstance(dataset, pd.DataFrame):
             if list(dataset.columns) == ['@timestamp', 'symbol_seq']:
                 if list(dataset.index.names) == ['seq_id', 'log_id']:
                     #then the format is correct
-                    #get the index for every sequence
-                    seq_ids = dataset.index.get_level_values('seq_id').unique()
-                    #split dataframe in a list of sequences
-                    log_sequences = [dataset.loc[seq_id] for seq_id in seq_ids]
-                    #turn the sequences into an array of logs
-                    return [np.array(df["symbol_seq"]) for df in log_sequences]
+                    #all the symbols are encoded at once
+                    symbols = dataset['symbol_seq'].values
+                    self.vocabulary.add(symbols)
+                    ids = self.vocabulary.encode(symbols)
+                    #group the ids by sequence, in order of appearance
+                    seq_codes, seq_ids = pd.factorize(dataset.index.get_level_values('seq_id'))
+                    order = np.argsort(seq_codes, kind = 'stable')
+                    offsets = np.zeros(len(seq_ids) + 1, dtype = np.int64)
+                    np.cumsum(np.bincount(seq_codes, minlength = len(seq_ids)), out = offsets[1:])
+                    return ids[order], offsets
         return False
     
     def preprocess_logseq(self, log_seq):
+        """Symbol ids of a sequence of logs, -1 for symbols not in the vocabulary.
+        If the sequence has an incorrect format, it returns False."""
         if isinstance(log_seq, pd.DataFrame):
             if list(log_seq.columns) == ['@timestamp', 'symbol_seq']:
-                return list(log_seq['symbol_seq'])
+                return self.vocabulary.encode(log_seq['symbol_seq'].values)
         return False
 
+    def first_positions(self, ids, offsets, point):
+        """Position, inside every sequence, of the first appearance of a symbol.
+
+        Args:
+            ids (ndarray): symbol ids of all the sequences, flat
+            offsets (ndarray): where every sequence starts
+            point (int): symbol id
+
+        Returns:
+            (ndarray): position in every sequence, -1 if it is not there.
+        """
+        hits = np.flatnonzero(ids == point)
+        seqs = np.searchsorted(offsets, hits, side = 'right') - 1
+        #hits are sorted, so the first one of every sequence is its first appearance
+        seqs, first = np.unique(seqs, return_index = True)
+        positions = np.full(len(offsets) - 1, -1, dtype = np.int64)
+        positions[seqs] = hits[first] - offsets[seqs]
+        return positions
+
+    def count_steps(self, ids, offsets, fixed_points):
+        """Counts, for every step in the sequences, in how many sequences each log appears.
+
+        Args:
+            ids (ndarray): symbol ids of all the sequences, flat
+            offsets (ndarray): where every sequence starts
+            fixed_points (list[string]): fixed points of the model
+
+        Returns:
+            (list[ndarray]): counts per symbol id, for every step.
+        """
+        n_seqs = len(offsets) - 1
+        n_symbols = len(self.vocabulary)
+        fixed_ids = self.vocabulary.encode(fixed_points)
+        #sequence and position inside it, of every log
+        lengths = np.diff(offsets)
+        seq_of_log = np.repeat(np.arange(n_seqs), lengths)
+        positions = np.arange(len(ids)) - offsets[seq_of_log]
+        
+        #get the index of every fixed_point, in every sequence
+        cuts = [self.first_positions(ids, offsets, point) for point in fixed_ids[1:-1]]
+        for point, point_cuts in zip(fixed_points[1:-1], cuts):
+            if (point_cuts < 0).any():
+                raise ValueError("fixed point '{}' is missing in {} sequences".format(point, (point_cuts < 0).sum()))
+        #adding start and end
+        cuts = [np.zeros(n_seqs, dtype = np.int64)] + cuts + [lengths - 1]
+        
+        step_counts = []
+        for i in range(len(cuts) - 1):
+            fixed_cnt = np.zeros(n_symbols, dtype = np.int64)
+            fixed_cnt[fixed_ids[i]] = n_seqs
+            step_counts.append(fixed_cnt)
+            #logs strictly between both fixed points
+            in_step = (positions > cuts[i][seq_of_log]) & (positions < cuts[i+1][seq_of_log])
+            #every log counts once per sequence
+            pairs = np.unique(seq_of_log[in_step] * n_symbols + ids[in_step])
+            step_counts.append(np.bincount(pairs % n_symbols, minlength = n_symbols))
+        fixed_cnt = np.zeros(n_symbols, dtype = np.int64)
+        fixed_cnt[fixed_ids[-1]] = n_seqs
+        step_counts.append(fixed_cnt)
+        return step_counts
+
+    def apply_noise_tol(self, noise_tol = None):
+        """Rebuilds the common logs of the model from its counts. The counts are kept, so the
+        tolerance can be changed without training again.
+
+        Args:
+            noise_tol (float): minimum density of a log to be common. Defaults to the one of the model.
+        """
+        if noise_tol is None:
+            noise_tol = self.model['noise_tol']
+        n_seqs = self.model['n_sequences']
+        #We apply the tolerance and delete every value with a density lower than the tolerance
+        self.model['common_logs'] = [
+            set(self.vocabulary.decode(np.flatnonzero(counts/n_seqs >= noise_tol)))
+            for counts in self.model['step_counts']
+        ]
+        self.model['noise_tol'] = noise_tol
+
     def fit(self, dataset, fixed_points, noise_tol = 1):
-        #init the list of splitted logs
-        log_seq_split = [[] for i in range(len(fixed_points)*2 - 1)]
-        dataset = self.preprocess_dataset(dataset)
+        self.vocabulary = SymbolVocabulary(fixed_points)
+        dataset = self.preprocess_dataset_flat(dataset)
         
-        if not dataset:
+        if dataset is False or len(dataset[1]) < 2:
             print("Bad dataset format!")
             return
         
-        #loop for each log sequence in the dataset
-        for log_seq in dataset:
-            #get the index of every fixed_point
-            cuts = [np.where(log_seq == point)[0][0] for point in fixed_points[1:-1]]
-            #adding start and end
-            cuts = [0 ,] + cuts + [len(log_seq)-1, ]
-            
-            #cutting every log sequence into sets, according to the fixed points
-            #sets corresponding at the same step in the secuence, go together in a list
-            for i in range(len(cuts)-1):
-                log_seq_split[2*i].append(np.array([fixed_points[i],]))
-                log_seq_split[2*i+1].append(np.unique(np.array(log_seq[cuts[i]+1: cuts[i+1]])))
-            log_seq_split[-1].append(np.array([fixed_points[-1],]))
-        
-        #To get the model, first we concatenate each set living in the same step
-        log_seq_concat = [np.concatenate(step) for step in log_seq_split]
-        #We count every log appereance
-        log_seq_cnt = [np.unique(step, return_counts = True) for step in log_seq_concat]
-        #We get the density of every log in each step, and store it in a dict
-        log_seq_dict = [dict(zip(step[0], step[1]/len(dataset))) for step in log_seq_cnt]
-        
-        #Finally we apply the tolerance and delete every value with a density lower than the tolerance
+        ids, offsets = dataset
         self.model = {
-            'common_logs': [{key for key, val in step.items() if val >= noise_tol} for step in log_seq_dict],
             'fixed_points': fixed_points,
+            'step_counts': self.count_steps(ids, offsets, fixed_points),
+            'n_sequences': len(offsets) - 1,
         }
+        self.apply_noise_tol(noise_tol)
+
+    def partial_fit(self, dataset, fixed_points = None, noise_tol = None):
+        """Updates the model with new sequences, without training it again with the old ones.
+        If there is no model yet, it is the same as fit.
+
+        Args:
+            dataset (DataFrame): dataframe with the new sequences of logs.
+            fixed_points (list[string]): only used, and required, when there is no model yet.
+            noise_tol (float): tolerance to apply. Defaults to the one of the model.
+
+        Raises:
+            ValueError: if there is no model yet and no fixed points are given, or if the
+                model was saved without counts, it must be fit again.
+        """
+        if not self.is_trained():
+            if fixed_points is None:
+                raise ValueError("The model is not trained yet, fixed_points are needed to fit it.")
+            self.fit(dataset, fixed_points, 1 if noise_tol is None else noise_tol)
+            return
+        if 'step_counts' not in self.model:
+            raise ValueError("The model has no counts to update, please fit it again.")
+        
+        dataset = self.preprocess_dataset_flat(dataset)
+        if dataset is False or len(dataset[1]) < 2:
+            print("Bad dataset format!")
+            return
+        
+        ids, offsets = dataset
+        new_counts = self.count_steps(ids, offsets, self.model['fixed_points'])
+        #the vocabulary may have grown, older counts have no entries for the new logs
+        self.model['step_counts'] = [
+            np.pad(counts, (0, len(self.vocabulary) - len(counts))) + new
+            for counts, new in zip(self.model['step_counts'], new_counts)
+        ]
+        self.model['n_sequences'] += len(offsets) - 1
+        self.apply_noise_tol(noise_tol)
     
-    def predict(self, log_seq_df):
+    def check_details(self, log_seq_df):
+        """Checks a sequence of logs against the model, step by step.
+
+        Args:
+            log_seq_df (DataFrame): sequence of logs
+
+        Returns:
+            (Bool, list[dict], list[dict]): if the sequence fits the model, the missing logs, and for
+            every pair of fixed points: if each one was found and the common logs checked between them
+            (None if they were not checked). None if there is no model or the sequence is bad.
+        """
         #from dataframe of logs to list of logs
         if not self.is_trained():
             return
         
         log_seq = self.preprocess_logseq(log_seq_df)
-        if not log_seq:
+        if log_seq is False or len(log_seq) == 0:
             print('Bad instance!')
             return
         
-        #prediction results in a graph
-        G = nx.Graph()
-        node_id = 0
-        x = 1
-        sub_node_id = len(self.model['fixed_points'])
-        
-        log_seq = np.array(log_seq)
         fits_model = True
         missing_list = []
+        steps = []
         fixed_points = self.model['fixed_points']
-        common_logs = self.model['common_logs']
+        fixed_ids = self.vocabulary.encode(fixed_points)
+        #common logs between fixed points, encoded all at once. Sets have no order, the
+        #missing logs are reported in sorted order
+        must_logs_steps = [sorted(log_set) for log_set in self.model['common_logs'][1::2]]
+        must_ids = self.vocabulary.encode([log for must_logs in must_logs_steps for log in must_logs])
+        must_ids_steps = np.split(must_ids, np.cumsum([len(must_logs) for must_logs in must_logs_steps])[:-1])
         
         #for each pair of fixed points, check every log in the model appears
         for i in range(len(fixed_points) - 1):
             points = fixed_points[i:i+2]
-            cuts = [np.where(log_seq == p)[0] for p in points]
+            cuts = [np.where(log_seq == p)[0] for p in fixed_ids[i:i+2]]
+            step = {'points': points, 'found': (cuts[0].size > 0, cuts[1].size > 0), 'logs': None}
             
             #last iteration
             if i == len(fixed_points) - 2:
@@ -121,11 +292,6 @@ class CommonLogs:
                         "fixedPointBefore": points[0],
                         "fixedPointAfter": points[1],
                     })
-                    G.add_node(node_id+1, pos = (x+1, 0), label = points[1], size = 50, color = 'red')
-                #if not
-                else:
-                    G.add_node(node_id+1, pos = (x+1, 0), label = points[1], size = 50, color = 'skyblue')
-                
             
             check_between = True
             
@@ -139,9 +305,6 @@ class CommonLogs:
                 #if is missing a final log, we can check in between eather way
                 check_between = False
                 fits_model = False
-                G.add_node(node_id, pos = (x, 0), label = points[0], size = 50, color = 'red')
-            else:
-                G.add_node(node_id, pos = (x, 0), label = points[0], size = 50, color = 'skyblue')
                     
             if cuts[1].size == 0:
                 missing_list.append({
@@ -152,39 +315,81 @@ class CommonLogs:
                 #if is missing a final log, we can check in between eather way
                 check_between = False
                 fits_model = False
-                        
             
             #if no fixed point is missin, check the logs between them.
             if check_between or i == len(fixed_points) - 2:
                 #assumption: not repeated fixed points
-                between_logs = set(log_seq[cuts[0][0]+1: cuts[1][0]])
-                must_logs = common_logs[2*i+1]
-                #missing = common_logs[2*i+1].difference(between_logs)
-                
-                delta_x = .6/len(common_logs[2*i+1])
+                between_logs = log_seq[cuts[0][0]+1: cuts[1][0]]
+                must_logs = must_logs_steps[i]
+                found = np.isin(must_ids_steps[i], between_logs)
+                step['logs'] = list(zip(must_logs, found))
+                for log in np.asarray(must_logs, dtype = object)[~found]:
+                    missing_list.append({
+                        "log": log,
+                        "fixedPointBefore": points[0],
+                        "fixedPointAfter": points[1],
+                    })
+                    fits_model = False
+            steps.append(step)
+        
+        return fits_model, missing_list, steps
+    
+    def check(self, log_seq_df):
+        """Like predict, but without the graph.
+
+        Args:
+            log_seq_df (DataFrame): sequence of logs
+
+        Returns:
+            (Bool, DataFrame): if the sequence fits the model and the missing logs.
+        """
+        details = self.check_details(log_seq_df)
+        if details is None:
+            return
+        fits_model, missing_list, _ = details
+        return fits_model, pd.DataFrame(missing_list)
+    
+    def prediction_graph(self, steps):
+        """Graph of a prediction, from the steps given by check_details."""
+        G = nx.Graph()
+        node_id = 0
+        x = 1
+        sub_node_id = len(self.model['fixed_points'])
+        
+        for i, step in enumerate(steps):
+            points = step['points']
+            #last iteration
+            if i == len(steps) - 1:
+                color = 'skyblue' if step['found'][1] else 'red'
+                G.add_node(node_id+1, pos = (x+1, 0), label = points[1], size = 50, color = color)
+            color = 'skyblue' if step['found'][0] else 'red'
+            G.add_node(node_id, pos = (x, 0), label = points[0], size = 50, color = color)
+            
+            if step['logs'] is not None:
+                delta_x = .6/len(step['logs'])
                 x_node = x + .2
-                for log in must_logs:
+                for log, log_found in step['logs']:
                     y_node = .5 * np.random.uniform(-1, 1)
-                    if log not in between_logs:
-                        missing_list.append({
-                            "log": log,
-                            "fixedPointBefore": points[0],
-                            "fixedPointAfter": points[1],
-                        })
-                        fits_model = False
-                        G.add_node(sub_node_id,pos=(x_node,y_node),label = log, size = 20, color = 'red')
-                    else:
-                        G.add_node(sub_node_id,pos=(x_node,y_node),label = log, size = 20, color = 'lightgreen')
+                    color = 'lightgreen' if log_found else 'red'
+                    G.add_node(sub_node_id,pos=(x_node,y_node),label = log, size = 20, color = color)
                     x_node += delta_x
                     sub_node_id += 1
                     
             if node_id != 0:
                 G.add_edge(node_id, node_id - 1)
-            if i == len(fixed_points) - 2:
+            if i == len(steps) - 1:
                 G.add_edge(node_id+1, node_id)
             x += 1
             node_id += 1
-                        
+        return G
+    
+    def predict(self, log_seq_df):
+        details = self.check_details(log_seq_df)
+        if details is None:
+            return
+        fits_model, missing_list, steps = details
+        #prediction results in a graph
+        G = self.prediction_graph(steps)
         missing_df = pd.DataFrame(missing_list)
         return fits_model, missing_df, G
     
@@ -198,7 +403,7 @@ class CommonLogs:
             
             if len(step) != 1:
                 
-                for node in step:
+                for node in sorted(step):
                     r = np.sqrt(np.random.uniform())
                     theta = np.random.uniform() * 2 * np.pi
                     
@@ -225,9 +430,18 @@ class CommonLogs:
             with open(f"{filepath}.JSON", 'w') as out:
                 #set is no json serializable
                 model_to_save = {
-                    'common_logs': [list(log_set) for log_set in self.model['common_logs']],
-                    'fixed_points': self.model['fixed_points']
+                    'common_logs': [sorted(log_set) for log_set in self.model['common_logs']],
+                    'fixed_points': self.model['fixed_points'],
+                    'vocabulary': list(self.vocabulary.symbols),
                 }
+                #counts are saved only for the logs that appeared
+                if 'step_counts' in self.model:
+                    model_to_save['step_counts'] = [
+                        {self.vocabulary.symbols[i]: int(counts[i]) for i in np.flatnonzero(counts)}
+                        for counts in self.model['step_counts']
+                    ]
+                    model_to_save['n_sequences'] = int(self.model['n_sequences'])
+                    model_to_save['noise_tol'] = self.model['noise_tol']
                 json.dump(model_to_save, out)
                 return True
             return False
@@ -239,6 +453,23 @@ class CommonLogs:
                 #set is no json serializable
                 loaded_model = json.load(model)
                 loaded_model['common_logs'] = [set(list_logs) for list_logs in loaded_model['common_logs']]
+                #models saved without vocabulary only know their own logs
+                vocabulary = loaded_model.pop('vocabulary', None)
+                if vocabulary is None:
+                    vocabulary = list(loaded_model['fixed_points']) + [
+                        log for log_set in loaded_model['common_logs'] for log in sorted(log_set)
+                    ]
+                self.vocabulary = SymbolVocabulary(vocabulary)
+                #counts go back to arrays indexed by symbol id
+                if 'step_counts' in loaded_model:
+                    for counts in loaded_model['step_counts']:
+                        self.vocabulary.add(counts.keys())
+                    step_counts = []
+                    for counts in loaded_model['step_counts']:
+                        dense = np.zeros(len(self.vocabulary), dtype = np.int64)
+                        dense[self.vocabulary.encode(list(counts.keys()))] = list(counts.values())
+                        step_counts.append(dense)
+                    loaded_model['step_counts'] = step_counts
                 self.model = loaded_model
                 return True
             return False
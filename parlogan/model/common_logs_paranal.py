@@ -2,8 +2,9 @@
 # This should go to a separate .py file
 from .base_model_paranal import BaseModelPARANAL
 from .common_logs import CommonLogs
+from .config import dataset_fields, prediction_margin
 from parlogan.db.es import log_scan
-from parlogan import format_to_datetime
+from parlogan import format_to_datetime, format_series_to_datetime
 import pandas as pd
 
 class CommonLogsPARANAL(BaseModelPARANAL, CommonLogs):
@@ -37,9 +38,9 @@ class CommonLogsPARANAL(BaseModelPARANAL, CommonLogs):
         start_ts = format_to_datetime(start_ts)
         end_ts = format_to_datetime(end_ts)
         
-        dataset = log_scan(self.query, start_ts, end_ts)
+        dataset = log_scan(self.query, start_ts, end_ts, source = dataset_fields, cache = True)
         if not dataset.empty:
-            dataset["@timestamp"] = dataset["@timestamp"].apply(format_to_datetime)
+            dataset["@timestamp"] = format_series_to_datetime(dataset["@timestamp"])
             return dataset.sort_values(by = ["@timestamp"])
         return dataset
     
@@ -50,26 +51,59 @@ class CommonLogsPARANAL(BaseModelPARANAL, CommonLogs):
         CommonLogs.fit(self, dataset, self.fixed_points, self.noise_tol)
         print('Succesful Gym Session: fitter then ever!')
         return True
-    
+
+    def partial_fit(self, start_ts, end_ts):
+        """
+        Updates the model with the logs between start_ts and end_ts, which
+        should not overlap with the ones already used to train it.
+        """
+        dataset = self.collect_training_dataset(start_ts, end_ts)
+        if dataset.empty:
+            return False
+        CommonLogs.partial_fit(self, dataset, self.fixed_points, self.noise_tol)
+        print('Succesful Gym Session: fitter then ever!')
+        return True
+
     ##############
     # Prediction #
     ##############
     
-    def collect_prediction_dataset(self, timestamp):
+    def collect_prediction_range(self, start_ts, end_ts):
         """
-        Return a pandas DataFrame with logs arround timestamp matching the query.
+        Return a pandas DataFrame with logs matching the query, from a margin
+        before start_ts to a margin after end_ts.
         """
-        timestamp = format_to_datetime(timestamp)
-        start_ts = timestamp - pd.Timedelta('4 hours')
-        end_ts = timestamp + pd.Timedelta('4 hours')
+        start_ts = format_to_datetime(start_ts) - pd.Timedelta(prediction_margin)
+        end_ts = format_to_datetime(end_ts) + pd.Timedelta(prediction_margin)
         
         dataset = log_scan(self.query, start_ts, end_ts)
         
         if not dataset.empty:
-            dataset["@timestamp"] = dataset["@timestamp"].apply(format_to_datetime)
+            dataset["@timestamp"] = format_series_to_datetime(dataset["@timestamp"])
             return dataset.sort_values(by = ["@timestamp"])
         return dataset
     
+    def collect_prediction_dataset(self, timestamp):
+        """
+        Return a pandas DataFrame with logs arround timestamp matching the query.
+        """
+        return self.collect_prediction_range(timestamp, timestamp)
+    
+    def collect_executions(self, events):
+        """
+        Return a pandas DataFrame with the start and end of every execution
+        found in events. Overwrite me, by default there are no executions.
+        """
+        return pd.DataFrame(columns = ['start', 'end'])
+    
+    def collect_execution_sequences(self, execs):
+        """
+        Return a list with the colorized sequence of logs of every execution
+        in execs, one per execution and in the order of execs. Overwrite me,
+        by default there are no sequences.
+        """
+        return []
+    
     def predict(self, timestamp):
         dataset = self.collect_prediction_dataset(timestamp)
         if len(dataset) == 0:
@@ -77,4 +111,80 @@ class CommonLogsPARANAL(BaseModelPARANAL, CommonLogs):
         for selins in dataset:
             self.last_prediction = CommonLogs.predict(self, selins)
         return self.last_prediction
+    
+    def predict_executions(self, execs):
+        """
+        Return execs with the prediction of every execution: if it fits the
+        model and the missing logs. Every execution is fetched once.
+        """
+        seqs = self.collect_execution_sequences(execs)
+        #sequences are matched to the executions by position
+        if len(seqs) != len(execs):
+            raise ValueError(f"[{self.__class__.__name__}] collected {len(seqs)} sequences for {len(execs)} executions")
+        predictions = [CommonLogs.check(self, seq) for seq in seqs]
+        execs = execs[['start', 'end']].copy()
+        execs['fits_model'] = [None if p is None else p[0] for p in predictions]
+        execs['missing'] = [None if p is None else p[1] for p in predictions]
+        return execs
+    
+    def predict_range(self, start_ts, end_ts):
+        """
+        Predicts every execution running between start_ts and end_ts, with a
+        single scan for all of them.
+        
+        Returns:
+            (DataFrame): start, end, fits_model and missing of every execution.
+        """
+        start_ts = format_to_datetime(start_ts)
+        end_ts = format_to_datetime(end_ts)
+        events = self.collect_prediction_range(start_ts, end_ts)
+        if events.empty:
+            return pd.DataFrame(columns = ['start', 'end', 'fits_model', 'missing'])
+        execs = self.collect_executions(events)
+        if execs.empty:
+            return pd.DataFrame(columns = ['start', 'end', 'fits_model', 'missing'])
+        execs = execs[(execs['start'] <= end_ts) & (execs['end'] >= start_ts)]
+        return self.predict_executions(execs).reset_index(drop = True)
+    
+    def predict_many(self, timestamps):
+        """
+        Predicts the executions running at every timestamp. Timestamps close
+        to each other share the scan, and every execution is predicted once
+        even if many timestamps fall inside it.
+        
+        Returns:
+            (DataFrame): timestamp, start, end, fits_model and missing, one row
+            per timestamp and execution running at that time.
+        """
+        timestamps = pd.Series([format_to_datetime(t) for t in timestamps]).sort_values()
+        columns = ['timestamp', 'start', 'end', 'fits_model', 'missing']
+        if timestamps.empty:
+            return pd.DataFrame(columns = columns)
+        #a new scan only when the margins around two timestamps do not overlap
+        window = (timestamps.diff() > 2 * pd.Timedelta(prediction_margin)).cumsum()
+        
+        results = []
+        for _, window_ts in timestamps.groupby(window):
+            events = self.collect_prediction_range(window_ts.iloc[0], window_ts.iloc[-1])
+            if events.empty:
+                continue
+            execs = self.collect_executions(events)
+            if execs.empty:
+                continue
+            execs = execs.reset_index(drop = True)
+            #executions running at every timestamp
+            running = [
+                (ts, index) for ts in window_ts
+                for index in execs.index[(execs['start'] <= ts) & (execs['end'] >= ts)]
+            ]
+            if not running:
+                continue
+            ts, indexes = zip(*running)
+            predictions = self.predict_executions(execs.loc[sorted(set(indexes))])
+            rows = predictions.loc[list(indexes)]
+            rows.insert(0, 'timestamp', list(ts))
+            results.append(rows)
         
+        if not results:
+            return pd.DataFrame(columns = columns)
+        return pd.concat(results).reset_index(drop = True)
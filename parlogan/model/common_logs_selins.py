@@ -1,8 +1,9 @@
 # +
 from .common_logs_paranal import CommonLogsPARANAL
-from parlogan import format_to_datetime
-from parlogan.db.es import log_scan
-from parlogan.color import SELINS
+from .config import dataset_fields
+from parlogan import format_to_datetime, format_series_to_datetime, SELINS_executions
+from parlogan.db.es import log_scan, log_scan_windows
+from parlogan.color import colorize_series, SELINS_profile
 import pandas as pd
 from parlogan import package_directory
 cl_selins_cache = package_directory + '/model/CommonLogsSELINSCache'
@@ -58,23 +59,25 @@ mswERR_TARGET_TIMEOUT "Command failed (SELINS)" )'
     ###########
     
     def apply_color(self, seq, mode = 'standard'):
-        seq['symbol_seq'] = (seq['envname'] +" "+
-                             seq['procname'] +" "+
-                             seq['logtext']).apply(lambda x: SELINS(x, mode))
+        seq['symbol_seq'] = colorize_series(seq['envname'].astype(str) +" "+
+                                            seq['procname'].astype(str) +" "+
+                                            seq['logtext'], SELINS_profile(mode))
 
         return seq[["@timestamp", "symbol_seq"]]
 
     def get_log_sequences(self, SELINS_exec, check_success = True):
+        #search all logs between start and end, close executions of a system are scanned together
+        #and all the scans of every system in the same pool
+        exec_logs = log_scan_windows(
+            [f"{system} AND (mswControl trkwsControl agwsControl procname: tif* /lt[1-4]...*/ TEL.ACTO* *ERR_* )"
+             for system in SELINS_exec["system"]],
+            list(zip(SELINS_exec["start"], SELINS_exec["end"])),
+            source = dataset_fields,
+            cache = True,
+        )
+        
         seqs = []
-        for index, row in SELINS_exec.iterrows():
-            #search all logs between start and end
-            system = row['system']
-            seq = log_scan(
-                f"{system} AND (mswControl trkwsControl agwsControl procname: tif* /lt[1-4]...*/ TEL.ACTO* *ERR_* )",
-                row["start"],
-                row["end"],
-            ).sort_values(by = ["@timestamp"])
-
+        for (index, row), seq in zip(SELINS_exec.iterrows(), exec_logs):
             #checking fixed points
             if not seq["logtext"].str.contains("Move M2 & M3").any() and check_success:
                 continue
@@ -84,7 +87,7 @@ mswERR_TARGET_TIMEOUT "Command failed (SELINS)" )'
                 continue 
 
             #timestamp to datetime
-            seq["@timestamp"] = seq["@timestamp"].apply(format_to_datetime)
+            seq["@timestamp"] = format_series_to_datetime(seq["@timestamp"])
 
             seq = seq[(seq["@timestamp"] >= row["start"]) & (seq["@timestamp"] <= row["end"])]
             seq = pd.concat([seq[seq["logtext"] != "Telescope active optics calibrated correction"],
@@ -99,59 +102,7 @@ mswERR_TARGET_TIMEOUT "Command failed (SELINS)" )'
         return seqs
     
     def apply_SELINS_FSM(self, SELINS_edges, no_end_delta = '30 minutes'):
-        count = 0
-        SELINS_exec = dict()
-        started = False
-        #get every SELINS execution
-        for index, row in SELINS_edges.iterrows():
-            #if the current log is a start
-            if "MSW: Received command: SELINS, Buffer:" in row["logtext"]:
-                #if already started, then there is no ending for the previous SELINS
-                #finish the current one with a no end.
-                if started:
-                    SELINS_exec[count]["end"] = SELINS_exec[count]["start"] + pd.Timedelta(no_end_delta)
-                    SELINS_exec[count]["no_end"] = True
-                    count += 1 
-                #starting a new SELINS execution
-                started = True
-                SELINS_exec[count] = {
-                    "start": row["@timestamp"],
-                    "end": None,
-                    "system": row['system'],
-                    "mswERR_TARGET_TIMEOUT": False,
-                    "command_failed": False,
-                    "no_end": False,
-                }
-            #error -> end SELINS execution
-            elif "mswERR_TARGET_TIMEOUT" in row["logtext"] and started:
-                SELINS_exec[count]["end"] = row["@timestamp"]
-                SELINS_exec[count]["mswERR_TARGET_TIMEOUT"] = True
-                started = False
-                count += 1
-
-            #command failed -> end SELINS execution
-            elif "Command failed (SELINS)" in row["logtext"] and started:
-                SELINS_exec[count]["end"] = row["@timestamp"]
-                SELINS_exec[count]["command_failed"] = True
-                started = False
-                count += 1
-
-            #good ending found -> end SELINS execution
-            elif "Telescope active optics calibrated correction" in row["logtext"] and started:
-                SELINS_exec[count]["end"] = row["@timestamp"]
-                started = False
-                count += 1
-
-        #checking if last execution ended
-        if count in SELINS_exec and SELINS_exec[count]['end'] == None:
-            del SELINS_exec[count]
-
-        SELINS_exec = pd.DataFrame.from_dict(SELINS_exec).T
-        if SELINS_exec.empty:
-            return SELINS_exec
-        
-        SELINS_exec['success'] = ~(SELINS_exec["mswERR_TARGET_TIMEOUT"] | SELINS_exec["command_failed"])
-        return SELINS_exec
+        return SELINS_executions(SELINS_edges, no_end_delta)
     
     def collect_training_dataset(self, start_ts, end_ts):
         events = super().collect_training_dataset(start_ts, end_ts).reset_index(drop = True)
@@ -176,12 +127,18 @@ mswERR_TARGET_TIMEOUT "Command failed (SELINS)" )'
         print(f'Training with {len(seqs)} examples :D')
         return x_train
     
-    def collect_prediction_dataset(self, timestamp):
-        events = super().collect_prediction_dataset(timestamp).reset_index(drop = True)
+    def collect_executions(self, events):
         if events.empty:
-            return []
-        
-        execs = self.apply_SELINS_FSM(events)
+            return pd.DataFrame()
+        return self.apply_SELINS_FSM(events.reset_index(drop = True))
+    
+    def collect_execution_sequences(self, execs):
+        seqs = self.get_log_sequences(execs, check_success = False)
+        return [self.apply_color(seq, 'standard') for seq in seqs]
+    
+    def collect_prediction_dataset(self, timestamp):
+        events = super().collect_prediction_dataset(timestamp)
+        execs = self.collect_executions(events)
         if execs.empty:
             return []
             
@@ -192,10 +149,7 @@ mswERR_TARGET_TIMEOUT "Command failed (SELINS)" )'
             return []
             
         execs["minutes"] = (execs['end'] - execs['start']).astype('timedelta64[m]')
-        seqs = self.get_log_sequences(execs, check_success = False)
-        seqs = [self.apply_color(seq, 'standard') for seq in seqs]
-        
-        return seqs
+        return self.collect_execution_sequences(execs)
     
     
         
@@ -1,14 +1,35 @@
 from .common_logs_paranal import CommonLogsPARANAL
-from parlogan import format_to_datetime
-from parlogan.db.es import log_scan
-from parlogan.color import PRESET
+from .config import dataset_fields
+from parlogan import format_to_datetime, format_series_to_datetime
+from parlogan.db.es import log_scan, log_scan_windows
+from parlogan.color import colorize_series
 import pandas as pd
 from parlogan import package_directory
-from scipy import interpolate as spint
+from parlogan.fsm import LogFSM, compiled_fsm
+import networkx as nx
 import datetime as dt
 cl_preset_cache = package_directory + '/model/CommonLogsUTPRESETCache'
 
 # +
+def get_PRESET_FSM():
+    """PRESET State Machine"""
+    H = nx.DiGraph()
+    H.add_edges_from([
+        ("_Start_", "START"),
+        ("START", "START"),
+        ("START", "END"),
+        ("END", "START"),
+    ])
+    # Add query filter
+    H.nodes["START"]['filter'] = 'Received command'
+    H.nodes["START"]['priority'] = 1
+    H.nodes["START"]['opens'] = True
+    H.nodes["END"]['filter'] = 'Succesfully completed'
+    H.nodes["END"]['closes'] = True
+    
+    return H
+
+
 class CommonLogsUTPRESET(CommonLogsPARANAL):
     def __init__(self, system, noise_tol = 1.):
         query = f'procname: prsControl AND system: {system} AND \
@@ -46,13 +67,15 @@ class CommonLogsUTPRESET(CommonLogsPARANAL):
     
     def get_PRESET_logs(self, PRESETS_df):
         all_PRESET_logs = []
-        for index, row in PRESETS_df.iterrows():
-            PRESET_logs = log_scan(
-                f"{self.system} (envname: (*alt* *az*) msw* agws* procname: (*ws* actcon* admain*))",
-                row["start"],
-                row["end"],
-            )
-            PRESET_logs['@timestamp'] = PRESET_logs['@timestamp'].apply(format_to_datetime)
+        #close PRESETs are scanned together
+        windows_logs = log_scan_windows(
+            f"{self.system} (envname: (*alt* *az*) msw* agws* procname: (*ws* actcon* admain*))",
+            list(zip(PRESETS_df["start"], PRESETS_df["end"])),
+            source = dataset_fields,
+            cache = True,
+        )
+        for (index, row), PRESET_logs in zip(PRESETS_df.iterrows(), windows_logs):
+            PRESET_logs['@timestamp'] = format_series_to_datetime(PRESET_logs['@timestamp'])
             PRESET_logs.sort_values(by = ['@timestamp'], inplace = True)
             PRESET_logs.reset_index(drop = True, inplace = True)
 
@@ -88,52 +111,38 @@ class CommonLogsUTPRESET(CommonLogsPARANAL):
         return all_PRESET_logs
     
     def apply_color_PRESET(self, PRESET_logs):
-        PRESET_logs['symbol_seq'] = PRESET_logs['logtext'].apply(PRESET)
+        PRESET_logs['symbol_seq'] = colorize_series(PRESET_logs['logtext'], 'PRESET')
         return PRESET_logs[["@timestamp", "symbol_seq"]]
     
     def collect_PRESETS(self, events, include_no_ends = False):
         if events.empty:
             return events
-        events = events[['@timestamp', 'logtext']]
+        events = events[['@timestamp', 'logtext']].reset_index(drop = True)
         
-        ends = events[events['logtext'].str.contains('Succesfully completed')].reset_index(drop=True)
-        starts =  events[events['logtext'].str.contains('Received command')].reset_index(drop=True)
-        
-        if ends.empty or starts.empty:
+        execs = compiled_fsm(get_PRESET_FSM()).executions(events)
+        if execs.empty:
             return pd.DataFrame()
         
-        starts.columns = ['start', 'buffer_start']
-        ends.columns = ['end', 'buffer_end']
-        
-        starts['buffer_start'] = starts.buffer_start.map(
-            lambda x: x.replace('PRESET: Received command: SETUP, Buffer: ', '')
-        )
-        ends['buffer_end'] = ends.buffer_end.map(
-            lambda x: x.replace('PRESET: Succesfully completed. Command: SETUP, Buffer: ', '')
-        )
+        #an execution is good if the buffer of its start and end are the same
+        buffer_start = events['logtext'].iloc[execs['start_row']].str.replace(
+            'PRESET: Received command: SETUP, Buffer: ', '', regex = False
+        ).values
+        buffer_end = events['logtext'].iloc[execs['end_row']].str.replace(
+            'PRESET: Succesfully completed. Command: SETUP, Buffer: ', '', regex = False
+        ).values
         
-        interpolate = spint.interp1d(
-            ends.end.values.astype(float), ends.end.values.astype(float),
-            kind='next', assume_sorted=True, fill_value='extrapolate'
-        )
-        starts['end'] = pd.to_datetime(interpolate(starts.start.values.astype(float)), utc=True).round('ms')
-        mask = starts['end'].shift(-1) == starts['end']
-
-        good_ends = starts[~mask]
-        data = pd.merge(good_ends, ends, on='end')
-        data = data[data.buffer_start == data.buffer_end].drop(columns=['buffer_start', 'buffer_end'])
+        data = execs[~execs['no_end'] & (buffer_start == buffer_end)][['start', 'end']]
         data['elapsed'] = data.end - data.start
         data = data[data.elapsed > dt.timedelta(seconds=5)].reset_index(drop = True)
         
-        no_ends = starts[mask]
+        #starts after the last end are left out, they may still be running
+        last_end = events['@timestamp'][events['logtext'].str.contains('Succesfully completed')].max()
+        no_ends = execs[execs['no_end'] & (execs['start'] <= last_end)][['start', 'end']]
         
         if include_no_ends and not no_ends.empty:
             no_ends['end'] = pd.concat([
-                starts.shift(-1)['start'][mask], no_ends['start'] + pd.Timedelta('15 minutes')
+                no_ends['end'], no_ends['start'] + pd.Timedelta('15 minutes')
             ], axis = 1).min(axis = 1)
-            
-            
-            no_ends.drop(columns = ['buffer_start'], inplace = True)
             no_ends['elapsed'] = no_ends.end - no_ends.start
 
             all_presets = pd.concat([no_ends, data]).reset_index(drop = True)
@@ -173,17 +182,22 @@ class CommonLogsUTPRESET(CommonLogsPARANAL):
         PRESET_train.index.set_names(["seq_id", "log_id"], inplace=True)
         return PRESET_train
     
+    def collect_executions(self, events):
+        return self.collect_PRESETS(events.reset_index(drop = True), include_no_ends = True)
+    
+    def collect_execution_sequences(self, execs):
+        all_PRESET_logs = self.get_PRESET_logs(execs)
+        return [self.apply_color_PRESET(PRESET_logs) for PRESET_logs in all_PRESET_logs]
+    
     def collect_prediction_dataset(self, timestamp):
-        events = super().collect_prediction_dataset(timestamp).reset_index(drop = True)
-        PRESETS = self.collect_PRESETS(events, include_no_ends = True)
+        events = super().collect_prediction_dataset(timestamp)
+        PRESETS = self.collect_executions(events)
         if PRESETS.empty:
             return PRESETS
         PRESETS = PRESETS[(PRESETS['start'] <= timestamp) & (PRESETS['end'] >= timestamp)]
         if PRESETS.empty:
             return PRESETS
-        all_PRESET_logs = self.get_PRESET_logs(PRESETS)
-        color_PRESETS = [self.apply_color_PRESET(PRESET_logs) for PRESET_logs in all_PRESET_logs]
-        return color_PRESETS
+        return self.collect_execution_sequences(PRESETS)
         
 #         execs = self.apply_SELINS_FSM(events)
 #         if execs.empty:
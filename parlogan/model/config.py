@@ -1 +1,6 @@
 
+#fields of the logs used to build datasets
+dataset_fields = ["@timestamp", "system", "envname", "procname", "logtext"]
+
+#logs scanned around a timestamp to find the executions running at that time
+prediction_margin = '4 hours'
@@ -1,12 +1,18 @@
 import pandas as pd
+import numpy as np
 pd.options.mode.chained_assignment = None
 import os
 import sys
-from parlogan.db.es import log_scan, EmptyElasticQuery
+from parlogan.db.es import log_scan, async_log_scan, EmptyElasticQuery, es_scan_slices
 from parlogan.systems import related_system_errors
-from parlogan import format_to_datetime, package_directory
+from parlogan import format_series_to_datetime, package_directory
+from parlogan.fsm import LogFSM, compiled_fsm
 import networkx as nx
 
+#logs of the OB state machine, %s is the instrument
+OBs_query = '(%s) AND logtext: ((OBS.NAME AND OBS.ID) \
+    "OB started at" "OB finished" "OB aborted" "OB paused" "OB continued" "ACK ABORT (red)")'
+
 params_regex = r"(?P<params>[A-Z0-9]+[A-Z0-9/. ]*) = (?P<value>.*)"
 params_regex_wogroups = r"[A-Z0-9]+[A-Z0-9/. ]* = .*"
 raw_data_folder = package_directory + '/cache/'
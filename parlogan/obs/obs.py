@@ -12,18 +12,24 @@ def OBs_between(system, start, end):
         (DataFrame): OBs found
     """
     
-    #name of the dataset
-    file_name = raw_data_folder + f'OBsBetween_{system}_{start.isoformat()}_{end.isoformat()}.csv'
-    raw_obs_logs = pd.DataFrame()
-    
-    #if os.path.exists(file_name):
-    #    raw_obs_logs = pd.read_csv(file_name)
-        
-    if raw_obs_logs.empty:
-        raw_obs_logs = log_scan('(%s) AND logtext: ((OBS.NAME AND OBS.ID) \
-            "OB started at" "OB finished" "OB aborted" "OB paused" "OB continued" "ACK ABORT (red)")' % system,
-            start, end)
-        raw_obs_logs.to_csv(file_name)
+    #overlapping windows only ask ES for the time not scanned yet
+    raw_obs_logs = log_scan(OBs_query % system, start, end, slices = es_scan_slices, cache = True)
+    return OBs_from_logs(raw_obs_logs)
+
+async def async_OBs_between(system, start, end):
+    """Async version of OBs_between"""
+    raw_obs_logs = await async_log_scan(OBs_query % system, start, end, slices = es_scan_slices, cache = True)
+    return OBs_from_logs(raw_obs_logs)
+
+def OBs_from_logs(raw_obs_logs):
+    """Get OBs from the logs found by OBs_query
+
+    Args:
+        raw_obs_logs (DataFrame)
+
+    Returns:
+        (DataFrame): OBs found
+    """
     
     #if empty, return none
     if raw_obs_logs.empty:
@@ -76,6 +82,10 @@ def get_OB_FSM():
     H.nodes["STOP"]['filter'] = "OB finished"
     H.nodes["(Manual Abort)"]['filter'] = "ACK ABORT (red)"
     H.nodes["ABORT"]['filter'] = "OB aborted after"
+    # Add what starts and ends an OB
+    H.nodes["START"]['opens'] = True
+    H.nodes["STOP"]['closes'] = True
+    H.nodes["ABORT"]['closes'] = True
     
     return H
 
@@ -90,87 +100,62 @@ def parse_observations(logs, H):
     Returns:
         (DataFrame): OBs found
     """
-    H.state = "_Start_"
-
+    FSM = compiled_fsm(H)
+    transitions = FSM.transitions(logs['logtext'])
+    H.state = FSM.states[transitions[-1][1]] if transitions else "_Start_"
+    
+    #each finished OB is a record: how it finished, and the logs where it started and ended
+    timestamps = logs['@timestamp'].reset_index(drop = True)
+    records = FSM.intervals(transitions, timestamps)[0]
+    manual_aborts = [row for row, state in transitions if FSM.states[state] == "(Manual Abort)"]
+    
+    if records.empty:
+        return pd.DataFrame()
+    
+    # INFO collectors, every log goes to the OB open when it arrives
+    reset_rows = records['end_row'].values
+    OB_of_log = np.searchsorted(reset_rows, np.arange(len(logs)), side = 'left')
+    logtext = logs['logtext'].astype(str)
+    # (OBS.NAME: 7-Cet // OBS.ID: 200454825)
+    is_name = logtext.str.contains('(OBS.NAME', regex = False).values
+    is_pause = logtext.str.contains('OB paused at', regex = False).values & ~is_name
+    is_ack = logtext.str.contains('ACK ABORT', regex = False).values & ~is_name & ~is_pause
+    
+    pauses = np.bincount(OB_of_log[is_pause], minlength = len(records) + 1)
+    ack_abort = np.bincount(OB_of_log[is_ack], minlength = len(records) + 1) > 0
+    ack_abort[OB_of_log[manual_aborts]] = True
+    name_rows = np.flatnonzero(is_name)
+    #the last name found in each OB wins
+    name_OBs, last = np.unique(OB_of_log[name_rows][::-1], return_index = True)
+    last_name_row = dict(zip(name_OBs.tolist(), name_rows[::-1][last].tolist()))
+    
     obs_dates = []
-    def clear_current_obs():
-        return {
-            'pauses': 0,
+    for OB, (start_row, end_row, state) in enumerate(zip(records['start_row'], records['end_row'], records['state'])):
+        current_obs = {
+            'pauses': int(pauses[OB]),
             'OBS.NAME': 'unknown',
             'OBS.ID': 'unknown',
-            'ACK ABORT': False,
-            'Aborted': False
-    }
-    
-    current_obs = clear_current_obs()
-    already_started = False
-    for index, row in logs.iterrows():
-        logtext = row['logtext']
-
-        # INFO collectors
-        # (OBS.NAME: 7-Cet // OBS.ID: 200454825)
-        if '(OBS.NAME' in logtext:
-            current_obs['OBS.NAME'] = logtext.split("//")[0].split(":")[1].strip() # 7-Cet
-            current_obs['OBS.ID'] = logtext.split(":")[2][:-1].strip() # 200454825
-            
-        elif 'OB paused at' in logtext:
-            current_obs['pauses'] += 1
-            
-        elif 'ACK ABORT' in logtext:
-            current_obs['ACK ABORT'] = True
-        else:
-        #print(row['@timestamp'], row['system'], row['procname'], row['logtext'])
-            pass
+            'ACK ABORT': bool(ack_abort[OB]),
+            'Aborted': state != "STOP",
+            'START': timestamps.iloc[start_row],
+        }
+        if OB in last_name_row:
+            name_log = logtext.iat[last_name_row[OB]]
+            current_obs['OBS.NAME'] = name_log.split("//")[0].split(":")[1].strip() # 7-Cet
+            current_obs['OBS.ID'] = name_log.split(":")[2][:-1].strip() # 200454825
         
-        NS = [ b for (a,b) in H.edges(H.state)
-            if 'filter' in H.nodes[b].keys()
-            and H.nodes[b]['filter'] in logtext ]
-
-        # I have several goal states, this shouldn't happen!
-        if len(NS) > 1:
-            print("WARNING: A state was already found from this transition")
-            print(H.state, NS)
-            sys.exit()
-            
-        # I have only and only one state.
-        elif len(NS) == 1:
-            #print(">> New state found: %s -> %s" % (H.state, b) )
-            H.state = NS[0]
-            # On Change, I will add this info to current_obs
-            if H.state == "START":
-                if already_started:
-                    #there is no finish log
-                    current_obs['END'] = (pd.to_datetime(row["@timestamp"], utc = True) - pd.Timedelta('1 second')).isoformat()
-                    current_obs["Seconds"] = (pd.to_datetime(current_obs['END'], utc = True) - pd.to_datetime(current_obs['START'], utc = True)).total_seconds()
-                    current_obs['Aborted'] = True
-                    
-                    obs_dates.append(dict(current_obs))
-                    current_obs = clear_current_obs()
-                    
-                current_obs['START'] = row["@timestamp"]
-                already_started = True
-            elif H.state == "(Manual Abort)":
-                current_obs['ACK ABORT'] = True
-
-            # OB finished (TERMINATED) in 4800 seconds at 2018-12-15T21:58:56
-            elif H.state == "STOP":
-                current_obs['END'] = row["@timestamp"]
-                current_obs["Seconds"] = int(logtext.split()[4])
-                # Consistency Check:
-                #if logtext.split()[7] != current_obs['START']:
-                # print("WARNING! ", current_obs['START'], logtext)
-                #( pd.to_datetime( a.split()[6] ) - pd.to_datetime("1970-01-01") ).total_seconds()
-
-            # OB aborted after 1669 seconds at 2018-12-01T20:16:03
-            elif H.state == "ABORT":
-                current_obs['END'] = row["@timestamp"]
-                current_obs["Seconds"] = int(logtext.split()[3])
-                current_obs['Aborted'] = True
-                
-            if H.state in ["ABORT", "STOP"]:
-                obs_dates.append(dict(current_obs))
-                current_obs = clear_current_obs()
-                already_started = False
+        if state is None:
+            current_obs['END'] = (pd.to_datetime(timestamps.iloc[end_row], utc = True) - pd.Timedelta('1 second')).isoformat()
+            current_obs["Seconds"] = (pd.to_datetime(current_obs['END'], utc = True) - pd.to_datetime(current_obs['START'], utc = True)).total_seconds()
+        # OB finished (TERMINATED) in 4800 seconds at 2018-12-15T21:58:56
+        elif state == "STOP":
+            current_obs['END'] = timestamps.iloc[end_row]
+            current_obs["Seconds"] = int(logtext.iat[end_row].split()[4])
+        # OB aborted after 1669 seconds at 2018-12-01T20:16:03
+        else:
+            current_obs['END'] = timestamps.iloc[end_row]
+            current_obs["Seconds"] = int(logtext.iat[end_row].split()[3])
+        obs_dates.append(current_obs)
 
     return pd.DataFrame.from_records(obs_dates)
 
@@ -216,17 +201,8 @@ def OB_logs_between(start, end, system):
     start = pd.to_datetime(start, utc = True)
     end = pd.to_datetime(end, utc = True)
     
-    #csv might exists with the data needed
-    filename = raw_data_folder + f"OBDescribe_{system}_{start.isoformat()}_{end.isoformat()}"
-    
-    if os.path.exists(filename):
-        OB_logs = pd.read_csv(filename)
-    else:
-        query = f'system: {system} AND ((bob*)(keywname: OBS.*))'
-        OB_logs = log_scan(query, start, end)
-        OB_logs.to_csv(filename)
-    
-    return OB_logs
+    query = f'system: {system} AND ((bob*)(keywname: OBS.*))'
+    return log_scan(query, start, end, cache = True)
 
 
 def get_OB_name_id(start, end, system):
@@ -240,7 +216,7 @@ def get_OB_name_id(start, end, system):
     Returns:
         (list[string], list[string]) name and id
     """
-    hits = log_scan(f'system:{system} AND logtext: OBS.NAME AND logtext: OBS.ID', start, end)
+    hits = log_scan(f'system:{system} AND logtext: OBS.NAME AND logtext: OBS.ID', start, end, cache = True)
     name_and_id = hits["logtext"].str.extract(r'\(OBS.NAME: (?P<name>.*) // OBS.ID: (?P<id>.*)\)').dropna()
     return (name_and_id['name'].iloc[0], name_and_id['id'].iloc[0])
 
@@ -497,7 +473,7 @@ def OB_describe(OB, system, prev_next = True, bobby_mode = True):
         OB_logs = OB_logs[OB_logs.procname.str.contains('bob')]
     
     
-    OB_logs['@timestamp'] = OB_logs['@timestamp'].apply(format_to_datetime)
+    OB_logs['@timestamp'] = format_series_to_datetime(OB_logs['@timestamp'])
     OB_logs = OB_logs.sort_values("@timestamp").reset_index(drop=True)
     
     #using just the columns that are needed
@@ -51,60 +51,85 @@ def format_to_datetime(timestamp):
     return pd.to_datetime(timestamp, utc=True)
 
 
+def format_series_to_datetime(timestamps):
+    """Takes a whole column of dates and turns it into datetimes. Epoch millis and
+    date strings are told apart once for the column, and it is converted in one pass.
 
-def apply_SELINS_FSM(SELINS_edges, system, no_end_delta = '30 minutes'):
-    count = 0
-    SELINS_exec = dict()
-    started = False
-    #get every SELINS execution
-    for index, row in SELINS_edges.iterrows():
-        #if the current log is a start
-        if "MSW: Received command: SELINS, Buffer:" in row["logtext"]:
-            #if already started, then there is no ending for the previous SELINS
-            #finish the current one with a no end.
-            if started:
-                SELINS_exec[count]["end"] = SELINS_exec[count]["start"] + pd.Timedelta(no_end_delta)
-                SELINS_exec[count]["no_end"] = True
-                count += 1 
-            #starting a new SELINS execution
-            started = True
-            SELINS_exec[count] = {
-                "start": row["@timestamp"],
-                "end": None,
-                "system": row['system'],
-                "mswERR_TARGET_TIMEOUT": False,
-                "command_failed": False,
-                "no_end": False,
-            }
-        #error -> end SELINS execution
-        elif "mswERR_TARGET_TIMEOUT" in row["logtext"] and started:
-            SELINS_exec[count]["end"] = row["@timestamp"]
-            SELINS_exec[count]["mswERR_TARGET_TIMEOUT"] = True
-            started = False
-            count += 1
-
-        #command failed -> end SELINS execution
-        elif "Command failed (SELINS)" in row["logtext"] and started:
-            SELINS_exec[count]["end"] = row["@timestamp"]
-            SELINS_exec[count]["command_failed"] = True
-            started = False
-            count += 1
-
-        #good ending found -> end SELINS execution
-        elif "Telescope active optics calibrated correction" in row["logtext"] and started:
-            SELINS_exec[count]["end"] = row["@timestamp"]
-            started = False
-            count += 1
-            
-    #checking if last execution ended
-    if count in SELINS_exec and SELINS_exec[count]['end'] == None:
-        del SELINS_exec[count]
-    
-    SELINS_exec = pd.DataFrame.from_dict(SELINS_exec).T
+    Args:
+        timestamps (Series): dates to be converted.
+
+    Returns:
+        (Series): UTC datetimes, with the index of timestamps.
+
+    """
+    return timestamps_to_datetime(timestamps)
+
+
+def get_SELINS_FSM():
+    """SELINS State Machine"""
+    H = nx.DiGraph()
+    H.add_edges_from([
+        ("_Start_", "START"),
+        ("START", "START"),
+        ("START", "mswERR_TARGET_TIMEOUT"),
+        ("START", "command_failed"),
+        ("START", "END"),
+        ("mswERR_TARGET_TIMEOUT", "START"),
+        ("command_failed", "START"),
+        ("END", "START"),
+    ])
+    # Add query filter, a start wins over everything else
+    H.nodes["START"]['filter'] = SELINS_event_keys['start']
+    H.nodes["START"]['priority'] = 3
+    H.nodes["START"]['opens'] = True
+    for priority, state in enumerate(["END", "command_failed", "mswERR_TARGET_TIMEOUT"]):
+        H.nodes[state]['filter'] = SELINS_event_keys[state.lower() if state == "END" else state]
+        H.nodes[state]['priority'] = priority
+        H.nodes[state]['closes'] = True
+    
+    return H
+
+
+def SELINS_executions(events, no_end_delta = '30 minutes'):
+    """Finds the SELINS executions in a sequence of events, with the state machine get_SELINS_FSM.
+    An execution goes from a start to the first timeout, command failed or good end after it.
+    If a new start comes before any of them, the execution gets no end and lasts no_end_delta.
+    The last execution is dropped if it is not finished yet.
+
+    Args:
+        events (DataFrame): logs with @timestamp, system and logtext, sorted by time.
+        no_end_delta (string): duration of the executions with no end.
+
+    Returns:
+        (DataFrame): start, end, system, mswERR_TARGET_TIMEOUT, command_failed, no_end and
+        success of every execution.
+
+    """
+    columns = ["start", "end", "system", "mswERR_TARGET_TIMEOUT", "command_failed", "no_end", "success"]
+    if events.empty:
+        return pd.DataFrame(columns = columns)
+    
+    execs = compiled_fsm(get_SELINS_FSM()).executions(events)
+    if execs.empty:
+        return pd.DataFrame(columns = columns)
+    
+    no_end = execs["no_end"].values
+    SELINS_exec = pd.DataFrame({
+        "start": execs["start"],
+        "end": execs["end"].where(~no_end, execs["start"] + pd.Timedelta(no_end_delta)),
+        "system": events["system"].values[execs["start_row"].values],
+        "mswERR_TARGET_TIMEOUT": (execs["state"] == "mswERR_TARGET_TIMEOUT").values,
+        "command_failed": (execs["state"] == "command_failed").values,
+        "no_end": no_end,
+    })
     SELINS_exec['success'] = ~(SELINS_exec["mswERR_TARGET_TIMEOUT"] | SELINS_exec["command_failed"])
     return SELINS_exec
 
 
+def apply_SELINS_FSM(SELINS_edges, system, no_end_delta = '30 minutes'):
+    return SELINS_executions(SELINS_edges, no_end_delta)
+
+
 def get_log_sequences(SELINS_exec, system, check_success = True):
     seqs = []
     for index, row in SELINS_exec.iterrows():
@@ -124,7 +149,7 @@ def get_log_sequences(SELINS_exec, system, check_success = True):
             continue 
 
         #timestamp to datetime
-        seq["@timestamp"] = seq["@timestamp"].apply(format_to_datetime)
+        seq["@timestamp"] = format_series_to_datetime(seq["@timestamp"])
 
         #in case the query delivers wrong dates
         seq = seq[(seq["@timestamp"] >= row["start"]) & (seq["@timestamp"] <= row["end"])]
@@ -147,9 +172,9 @@ def get_log_sequences(SELINS_exec, system, check_success = True):
 
 
 def apply_color(seq, mode = 'standard'):
-    seq['symbol_seq'] = (seq['envname'] +" "+
-                         seq['procname'] +" "+
-                         seq['logtext']).apply(lambda x: SELINS(x, mode))
+    seq['symbol_seq'] = colorize_series(seq['envname'].astype(str) +" "+
+                                        seq['procname'].astype(str) +" "+
+                                        seq['logtext'], SELINS_profile(mode))
     
     return seq[["@timestamp", "symbol_seq"]]
 
@@ -162,8 +187,8 @@ def get_SELINS_training_data(date, delta_time, system, no_end_time, min_mins, ma
     ("MSW: Received command: SELINS, Buffer:" "Telescope active optics calibrated correction" \
     mswERR_TARGET_TIMEOUT "Command failed (SELINS)" )' % system
     
-    SELINS_borders = log_scan(query, start, end).sort_values(by = ["@timestamp"])
-    SELINS_borders["@timestamp"] = SELINS_borders["@timestamp"].apply(format_to_datetime)
+    SELINS_borders = log_scan(query, start, end, slices = es_scan_slices).sort_values(by = ["@timestamp"])
+    SELINS_borders["@timestamp"] = format_series_to_datetime(SELINS_borders["@timestamp"])
     SELINS_exec = apply_SELINS_FSM(SELINS_borders, system, no_end_delta = no_end_time)
     SELINS_exec["minutes"] = (SELINS_exec['end'] - SELINS_exec['start']).astype('timedelta64[m]')
     SELINS_train = SELINS_exec[(SELINS_exec["minutes"] > min_mins) &
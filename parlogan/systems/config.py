@@ -1,8 +1,21 @@
 import pandas as pd
 pd.options.mode.chained_assignment = None
-from parlogan.db.es import log_scan, EmptyElasticQuery
-from parlogan.info import error_counting
+from parlogan.db.es import log_scan, async_log_scan, EmptyElasticQuery, map_concurrently, es_cache_settle
+from parlogan import package_directory
+from parlogan.info import error_counting, async_error_counting
 import numpy as np
+import asyncio
+import threading
+import json
+import os
+import shutil
 from datetime import datetime, time
 
 VLTi_instruments = ["GRAVITY", "PIONIER", "MATISSE"]
+
+#an instrument is on the telescope of its last SELINS, if it was not older than this
+SELINS_lookback = '30 days'
+#local timeline of the telescope of every instrument
+telescope_timeline_folder = os.path.join(package_directory, 'cache', 'telescope_timeline')
+#local calendar of the nights of every telescope
+night_calendar_folder = os.path.join(package_directory, 'cache', 'night_calendar')
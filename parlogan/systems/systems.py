@@ -1,42 +1,38 @@
 from .config import *
 
 def telescope_night(timestamp, telescope):
-    timestamp = pd.to_datetime(timestamp)
-    if timestamp.time() < time(12, 0):
-        #we need to see the previous night
-        end = datetime.combine(timestamp.date(), time(12, 0))
-        start = end - pd.Timedelta('1 day')
-    else:
-        #we need to see the next night
-        start = datetime.combine(timestamp.date(), time(12, 0))
-        end = start + pd.Timedelta('1 day')
-    print(start, end)
-        
-    query = f'{telescope} AND TEL.ENCL.SLITDOOR*'
-    
-    slitdoor = log_scan(query, start, end)
-    
-    if slitdoor.empty:
+    """Night of a telescope containing timestamp, from the night calendar.
+
+    Returns:
+        (Timestamp, Timestamp): slit door opening and closure. None if the slit
+            door did not move that day.
+    """
+    night = telescope_nights([timestamp], telescope).iloc[0]
+    if not night['slitdoor']:
         return
-    
-    slitdoor.sort_values(by = '@timestamp', inplace = True)
-    night_start = slitdoor[slitdoor['keywname'] == 'TEL.ENCL.SLITDOOR.OPEN']
-    if night_start.empty:
-        #there was no opening log
-        night_start = start
-    else:
-        night_start = night_start.iloc[0]['@timestamp']
-    
-    night_end = slitdoor[
-        (slitdoor['keywname'] == 'TEL.ENCL.SLITDOOR.CLOSE') &
-        (slitdoor['@timestamp'] > night_start)
-    ]
-    if night_end.empty:
-        #there was no closure
-        night_end = end
-    else:
-        night_end = night_end.iloc[0]['@timestamp']
-    return (night_start, night_end)
+    return (night['night_start'], night['night_end'])
+
+def telescope_nights(timestamps, telescope):
+    """Nights of a telescope containing many timestamps at once. A night goes from
+    noon to noon (UTC), it starts when the slit door opens (or at noon) and ends
+    when it closes after that (or at the next noon).
+
+    Args:
+        timestamps (list[timestamp])
+        telescope (string)
+
+    Returns:
+        (DataFrame): timestamp, noon (start of the day of the night), night_start,
+            night_end and slitdoor (if the slit door moved that day). One row per
+            timestamp, in the same order.
+    """
+    timestamps = pd.Series([_wall_time(timestamp) for timestamp in timestamps], dtype = 'datetime64[ns]')
+    noons = (timestamps - pd.Timedelta('12 hours')).dt.floor('D') + pd.Timedelta('12 hours')
+    noons = noons.dt.tz_localize('UTC')
+    calendar = extend_night_calendar(telescope, noons.min(), noons.max()) if len(noons) else _empty_calendar()
+    nights = pd.DataFrame({'noon': noons}).merge(calendar, on = 'noon', how = 'left')
+    nights.insert(0, 'timestamp', timestamps)
+    return nights
 
 def instrument_night(timestamp, instr):
     telescope = telescope_by_instrument(timestamp, instr)
@@ -44,21 +40,60 @@ def instrument_night(timestamp, instr):
 
 
 def telescope_by_instrument(timestamp, instr):
-    end = pd.to_datetime(timestamp, utc = True)
-    start = pd.to_datetime(timestamp, utc = True) - pd.Timedelta('30 days')
-    query = f'system: (UT*) AND SELINS AND {instr}'
-    SELINS = log_scan(query, start, end)
+    return telescopes_by_instrument([timestamp], instr).iloc[0]
+
+async def async_telescope_by_instrument(timestamp, instr):
+    #the timeline is local, ES is only asked for the time not covered yet
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, telescope_by_instrument, timestamp, instr)
+
+def telescopes_by_instrument(timestamps, instr):
+    """Telescope of an instrument at many timestamps at once: the system of its
+    last SELINS, if it was in the SELINS_lookback before. Answered from the
+    telescope timeline, which is extended first if it does not cover them.
+
+    Args:
+        timestamps (list[timestamp])
+        instr (string): instrument
+
+    Returns:
+        (Series): telescope at every timestamp, None if there was no SELINS.
+    """
+    timestamps = pd.Series(pd.to_datetime(pd.Series(timestamps), utc = True).values)
+    if timestamps.empty:
+        return pd.Series([], dtype = object)
+    lookback = pd.Timedelta(SELINS_lookback)
+    settled = pd.Timestamp.now(tz = 'UTC') - pd.Timedelta(es_cache_settle)
+    first = timestamps.min().tz_localize('UTC') - lookback
+    last = timestamps.max().tz_localize('UTC')
     
-    if SELINS.empty:
-        return
+    runs, covered_until = extend_telescope_timeline(instr, first, min(last, settled))
+    if last > covered_until:
+        #SELINS still arriving are scanned every time, they are not stored
+        tail = log_scan(_SELINS_query(instr), covered_until, last, source = ["@timestamp", "system"])
+        if not tail.empty:
+            runs = _SELINS_runs(pd.concat([runs, _SELINS_events(tail)], ignore_index = True))
     
-    SELINS.sort_values(by = '@timestamp', ascending = False, inplace = True)
-    SELINS.reset_index(drop = True, inplace = True)
-    return SELINS.iloc[0]['system']
+    valid_to = _valid_to(runs)
+    positions = np.searchsorted(runs['valid_from'].values, timestamps.values, side = 'right') - 1
+    found = positions >= 0
+    found[found] = timestamps.values[found] <= valid_to.values[positions[found]]
+    telescopes = np.full(len(timestamps), None, dtype = object)
+    telescopes[found] = runs['telescope'].values[positions[found]]
+    return pd.Series(telescopes)
+
 
 def VLTi_telescop_type(timestamp):
     few_hours_ago = pd.to_datetime(timestamp) - pd.Timedelta(hours = 12)
-    res = repr(log_scan('ISS.ARRAY.ARM', few_hours_ago, timestamp).sort_values("@timestamp").tail(1))
+    return _VLTi_systems(log_scan('ISS.ARRAY.ARM', few_hours_ago, timestamp))
+
+async def async_VLTi_telescop_type(timestamp):
+    few_hours_ago = pd.to_datetime(timestamp) - pd.Timedelta(hours = 12)
+    return _VLTi_systems(await async_log_scan('ISS.ARRAY.ARM', few_hours_ago, timestamp))
+
+def _VLTi_systems(array_arm):
+    """Systems of the VLTi, given the last ISS.ARRAY.ARM logs"""
+    res = repr(array_arm.sort_values("@timestamp").tail(1))
     if "AT" in res:
         return ["AT*", "NAOMI*", "DL RMNREC ARAL ISS"]
     elif "UT" in res:
@@ -74,33 +109,63 @@ def instrument_related_systems(timestamp, instr):
     #the rest
     return [telescope_by_instrument(timestamp, instr), ]
 
+async def async_instrument_related_systems(timestamp, instr):
+    if instr in VLTi_instruments:
+        return await async_VLTi_telescop_type(timestamp)
+    return [await async_telescope_by_instrument(timestamp, instr), ]
+
 
 def related_system_errors(start, end, instr, delta = None):
     related_systems = instrument_related_systems(end, instr)
     related_systems = [instr, ] + related_systems
-    all_sys_errors = dict()
-    for related_sys in related_systems:
+    
+    #errors of every system are counted at the same time
+    def system_errors(related_sys):
         try:
-            if delta == None:
-                errors = error_counting(
-                    system = related_sys,
-                    start = start,
-                    end = end,
-                    group_keys = ["errkey", "system"],
-                    group_by_time = False
-                )
-            else:
-                errors = error_counting(
-                    system = related_sys,
-                    start = start,
-                    end = end,
-                    group_keys = ["errkey", "system"],
-                    delta = delta
-                )
+            return error_counting(**_system_errors_args(related_sys, start, end, delta))
         except EmptyElasticQuery:
-            continue
+            return None
+    
+    return _group_system_errors(related_systems, map_concurrently(system_errors, related_systems))
+
+async def async_related_system_errors(start, end, instr, delta = None):
+    related_systems = await async_instrument_related_systems(end, instr)
+    related_systems = [instr, ] + related_systems
+    
+    async def system_errors(related_sys):
+        try:
+            return await async_error_counting(**_system_errors_args(related_sys, start, end, delta))
+        except EmptyElasticQuery:
+            return None
+    
+    errors = await asyncio.gather(*(system_errors(related_sys) for related_sys in related_systems))
+    return _group_system_errors(related_systems, errors)
+
+def _system_errors_args(related_sys, start, end, delta):
+    """error_counting arguments for the errors of a related system"""
+    if delta == None:
+        return dict(
+            system = related_sys,
+            start = start,
+            end = end,
+            group_keys = ["errkey", "system"],
+            group_by_time = False,
+            aggregate = True
+        )
+    return dict(
+        system = related_sys,
+        start = start,
+        end = end,
+        group_keys = ["errkey", "system"],
+        delta = delta,
+        aggregate = True
+    )
 
-        if errors.empty:
+def _group_system_errors(related_systems, errors_list):
+    """Errors of every related system, split by system and sorted by count"""
+    all_sys_errors = dict()
+    for related_sys, errors in zip(related_systems, errors_list):
+        if errors is None or errors.empty:
             continue
 
         all_sys_errors[related_sys] = {
@@ -109,3 +174,272 @@ def related_system_errors(start, end, instr, delta = None):
         }
 
     return all_sys_errors
+
+
+######################
+# Telescope timeline #
+######################
+
+_timeline_lock = threading.Lock()
+_timeline = dict()
+
+def _SELINS_query(instr):
+    return f'system: (UT*) AND SELINS AND {instr}'
+
+def _SELINS_events(SELINS):
+    """Every SELINS as a run of its own"""
+    timestamps = pd.to_datetime(SELINS['@timestamp'], utc = True).reset_index(drop = True)
+    return pd.DataFrame({
+        'telescope': SELINS['system'].astype(str).reset_index(drop = True),
+        'valid_from': timestamps,
+        'last_seen': timestamps,
+    })
+
+def _SELINS_runs(runs):
+    """Merges runs of SELINS to the same telescope closer than SELINS_lookback.
+
+    Args:
+        runs (DataFrame): telescope, valid_from (first SELINS) and last_seen (last SELINS)
+
+    Returns:
+        (DataFrame): merged runs, sorted by valid_from
+    """
+    runs = runs.sort_values(by = ['valid_from', 'last_seen'], kind = 'mergesort').reset_index(drop = True)
+    if runs.empty:
+        return runs
+    new_run = (runs['telescope'] != runs['telescope'].shift()) | \
+        (runs['valid_from'] - runs['last_seen'].cummax().shift() > pd.Timedelta(SELINS_lookback))
+    run = new_run.cumsum()
+    return pd.DataFrame({
+        'telescope': runs['telescope'].groupby(run).first(),
+        'valid_from': runs['valid_from'].groupby(run).first(),
+        'last_seen': runs['last_seen'].groupby(run).max(),
+    }).reset_index(drop = True)
+
+def _valid_to(runs):
+    """Until when every run holds: SELINS_lookback after its last SELINS, or the next run"""
+    valid_to = runs['last_seen'] + pd.Timedelta(SELINS_lookback)
+    next_from = runs['valid_from'].shift(-1)
+    return valid_to.where(next_from.isna() | (valid_to < next_from), next_from)
+
+def _timeline_files(instr):
+    name = "".join(c if c.isalnum() else '_' for c in instr.strip()) or '_'
+    return (os.path.join(telescope_timeline_folder, name + '.parquet'),
+            os.path.join(telescope_timeline_folder, name + '.json'))
+
+def _load_timeline(instr):
+    """Runs and covered time range of instr, from memory or disk"""
+    if instr not in _timeline:
+        runs_file, coverage_file = _timeline_files(instr)
+        if os.path.exists(coverage_file):
+            with open(coverage_file) as f:
+                coverage = json.load(f)
+            if coverage['instrument'] == instr:
+                _timeline[instr] = (
+                    pd.read_parquet(runs_file),
+                    (pd.Timestamp(coverage['start']), pd.Timestamp(coverage['end']))
+                )
+                return _timeline[instr]
+        _timeline[instr] = (
+            pd.DataFrame({
+                'telescope': pd.Series([], dtype = object),
+                'valid_from': pd.Series([], dtype = 'datetime64[ns, UTC]'),
+                'last_seen': pd.Series([], dtype = 'datetime64[ns, UTC]'),
+            }),
+            None
+        )
+    return _timeline[instr]
+
+def extend_telescope_timeline(instr, start, end):
+    """Makes the telescope timeline of instr cover from start to end. Only the
+    time not covered yet is scanned.
+
+    Args:
+        instr (string): instrument
+        start (timestamp)
+        end (timestamp)
+
+    Returns:
+        (DataFrame, Timestamp): runs of SELINS of instr to a telescope (telescope,
+            valid_from and last_seen) and until when they are known.
+    """
+    start = pd.to_datetime(start, utc = True)
+    end = pd.to_datetime(end, utc = True)
+    with _timeline_lock:
+        runs, coverage = _load_timeline(instr)
+        if coverage is None:
+            if start >= end:
+                return runs, start
+            gaps = [(start, end)]
+            coverage = (start, end)
+        else:
+            gaps = [gap for gap in [(start, coverage[0]), (coverage[1], end)] if gap[0] < gap[1]]
+            if not gaps:
+                return runs, coverage[1]
+            coverage = (min(start, coverage[0]), max(end, coverage[1]))
+        
+        SELINS = [
+            log_scan(_SELINS_query(instr), gap_start, gap_end, source = ["@timestamp", "system"])
+            for gap_start, gap_end in gaps
+        ]
+        runs = _SELINS_runs(pd.concat([runs] + [_SELINS_events(logs) for logs in SELINS if not logs.empty],
+                                      ignore_index = True))
+        _timeline[instr] = (runs, coverage)
+        
+        #written aside and renamed, a half written timeline is never read
+        runs_file, coverage_file = _timeline_files(instr)
+        os.makedirs(telescope_timeline_folder, exist_ok = True)
+        runs.to_parquet(runs_file + '.tmp', index = False)
+        os.replace(runs_file + '.tmp', runs_file)
+        with open(coverage_file + '.tmp', 'w') as f:
+            json.dump({'instrument': instr, 'start': coverage[0].isoformat(), 'end': coverage[1].isoformat()}, f)
+        os.replace(coverage_file + '.tmp', coverage_file)
+        return runs, coverage[1]
+
+def telescope_timeline(instr):
+    """Timeline of the telescope of instr known so far.
+
+    Returns:
+        (DataFrame): instrument, telescope, valid_from and valid_to
+    """
+    with _timeline_lock:
+        runs, _ = _load_timeline(instr)
+    timeline = runs[['telescope', 'valid_from']].copy()
+    timeline.insert(0, 'instrument', instr)
+    timeline['valid_to'] = _valid_to(runs)
+    return timeline
+
+def clear_telescope_timeline():
+    """Deletes every telescope timeline"""
+    with _timeline_lock:
+        _timeline.clear()
+        shutil.rmtree(telescope_timeline_folder, ignore_errors = True)
+
+
+##################
+# Night calendar #
+##################
+
+_calendar_lock = threading.Lock()
+_calendars = dict()
+
+def _wall_time(timestamp):
+    """Timestamp as a naive datetime, with the wall time of its timezone"""
+    timestamp = pd.to_datetime(timestamp)
+    if timestamp.tzinfo is not None:
+        return timestamp.tz_localize(None)
+    return timestamp
+
+def _empty_calendar():
+    return pd.DataFrame({
+        'noon': pd.Series([], dtype = 'datetime64[ns, UTC]'),
+        'night_start': pd.Series([], dtype = 'datetime64[ns, UTC]'),
+        'night_end': pd.Series([], dtype = 'datetime64[ns, UTC]'),
+        'slitdoor': pd.Series([], dtype = bool),
+    })
+
+def _calendar_file(telescope):
+    name = "".join(c if c.isalnum() else '_' for c in telescope.strip()) or '_'
+    return os.path.join(night_calendar_folder, name + '.parquet')
+
+def _scan_nights(telescope, first_noon, last_noon):
+    """Nights of every day from first_noon to last_noon, with a single scan.
+
+    Returns:
+        (DataFrame): noon, night_start, night_end and slitdoor of every day
+    """
+    noons = pd.date_range(first_noon, last_noon, freq = 'D')
+    slitdoor = log_scan(
+        f'{telescope} AND TEL.ENCL.SLITDOOR*',
+        first_noon, last_noon + pd.Timedelta('1 day'),
+        source = ['@timestamp', 'keywname']
+    )
+    nights = pd.DataFrame({'noon': noons})
+    nights['night_start'] = nights['noon']
+    nights['night_end'] = nights['noon'] + pd.Timedelta('1 day')
+    nights['slitdoor'] = False
+    if slitdoor.empty:
+        return nights
+    
+    slitdoor = slitdoor.sort_values(by = '@timestamp', kind = 'mergesort')
+    slitdoor['noon'] = (slitdoor['@timestamp'] - pd.Timedelta('12 hours')).dt.floor('D') + pd.Timedelta('12 hours')
+    #a log at noon is in the day before too
+    at_noon = slitdoor[slitdoor['@timestamp'] == slitdoor['noon']]
+    at_noon['noon'] = at_noon['noon'] - pd.Timedelta('1 day')
+    slitdoor = pd.concat([slitdoor, at_noon], ignore_index = True)
+    slitdoor = slitdoor[slitdoor['noon'].isin(noons)]
+    
+    nights = nights.set_index('noon')
+    nights.loc[slitdoor['noon'].unique(), 'slitdoor'] = True
+    #first opening, if there was no opening log the night starts at noon
+    opens = slitdoor[slitdoor['keywname'] == 'TEL.ENCL.SLITDOOR.OPEN'].groupby('noon')['@timestamp'].min()
+    nights.loc[opens.index, 'night_start'] = opens
+    #first closure after the opening, if there was none the night ends at noon
+    closes = slitdoor[slitdoor['keywname'] == 'TEL.ENCL.SLITDOOR.CLOSE']
+    closes = closes[closes['@timestamp'].values > nights.loc[closes['noon'], 'night_start'].values]
+    closes = closes.groupby('noon')['@timestamp'].min()
+    nights.loc[closes.index, 'night_end'] = closes
+    return nights.reset_index()
+
+def extend_night_calendar(telescope, first_noon, last_noon):
+    """Makes the night calendar of a telescope cover every day from first_noon to
+    last_noon. Only the days not in the calendar are scanned, days not over yet
+    (up to es_cache_settle) are scanned every time and not stored.
+
+    Args:
+        telescope (string)
+        first_noon (timestamp): noon (UTC) starting the first day
+        last_noon (timestamp): noon (UTC) starting the last day
+
+    Returns:
+        (DataFrame): noon, night_start, night_end and slitdoor of every day
+    """
+    first_noon = pd.to_datetime(first_noon, utc = True)
+    last_noon = pd.to_datetime(last_noon, utc = True)
+    settled = pd.Timestamp.now(tz = 'UTC') - pd.Timedelta(es_cache_settle)
+    with _calendar_lock:
+        if telescope not in _calendars:
+            calendar_file = _calendar_file(telescope)
+            _calendars[telescope] = pd.read_parquet(calendar_file) if os.path.exists(calendar_file) \
+                else _empty_calendar()
+        calendar = _calendars[telescope]
+        
+        noons = pd.date_range(first_noon, last_noon, freq = 'D')
+        missing = noons[~noons.isin(calendar['noon'])]
+        if missing.empty:
+            return calendar[calendar['noon'].isin(noons)]
+        
+        #consecutive missing days share the scan
+        block = np.cumsum(np.diff(missing.asi8, prepend = missing.asi8[0]) != pd.Timedelta('1 day').value)
+        scanned = pd.concat([
+            _scan_nights(telescope, block_noons.iloc[0], block_noons.iloc[-1])
+            for _, block_noons in pd.Series(missing).groupby(block)
+        ], ignore_index = True)
+        over = scanned['noon'] + pd.Timedelta('1 day') <= settled
+        if over.any():
+            calendar = pd.concat([calendar, scanned[over]], ignore_index = True)
+            calendar = calendar.sort_values(by = 'noon').reset_index(drop = True)
+            _calendars[telescope] = calendar
+            os.makedirs(night_calendar_folder, exist_ok = True)
+            calendar.to_parquet(_calendar_file(telescope) + '.tmp', index = False)
+            os.replace(_calendar_file(telescope) + '.tmp', _calendar_file(telescope))
+        nights = pd.concat([calendar[calendar['noon'].isin(noons)], scanned[~over]], ignore_index = True)
+        return nights.sort_values(by = 'noon').reset_index(drop = True)
+
+def night_calendar(telescope):
+    """Nights of a telescope known so far.
+
+    Returns:
+        (DataFrame): noon, night_start, night_end and slitdoor of every day
+    """
+    with _calendar_lock:
+        if telescope not in _calendars:
+            calendar_file = _calendar_file(telescope)
+            return pd.read_parquet(calendar_file) if os.path.exists(calendar_file) else _empty_calendar()
+        return _calendars[telescope].copy()
+
+def clear_night_calendar():
+    """Deletes every night calendar"""
+    with _calendar_lock:
+        _calendars.clear()
+        shutil.rmtree(night_calendar_folder, ignore_errors = True)
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import pytest
+import parlogan.db.es.es as es
+import parlogan.info.info as info
+
+base = pd.Timestamp('2020-01-01', tz = 'UTC')
+rng = np.random.default_rng(0)
+logs = [
+    {'@timestamp': (base + pd.Timedelta(seconds = float(second))).isoformat(timespec = 'milliseconds'),
+     'system': 'UT1', 'envname': 'e%d' % (i % 3), 'hostname': 'h', 'loghost': 'lh', 'module': 'm',
+     'errkey': 'xxERR_K%d' % (i % 4), 'logtext': 'xxERR_K%d : boom' % (i % 4)}
+    for i, second in enumerate(np.sort(rng.uniform(3600, 86400, 3000)))
+]
+
+def in_range(body, log):
+    timestamps = body['query']['bool']['must'][1]['range']['@timestamp']
+    timestamp = pd.Timestamp(log['@timestamp'])
+    return pd.to_datetime(timestamps['gte'], utc = True).floor('ms') <= timestamp \
+        <= pd.to_datetime(timestamps['lte'], utc = True)
+
+
+class FakeClient:
+    """Field caps and composite aggregations of ES over logs, buckets aligned to the epoch"""
+    def field_caps(self, index, fields):
+        return {'fields': {field: {'keyword': {'aggregatable': True}} for field in fields.split(',')}}
+
+    def search(self, index, body, request_timeout = None):
+        composite = body['aggs']['groups']['composite']
+        names = [list(source)[0] for source in composite['sources']]
+        counts = {}
+        for log in logs:
+            if not in_range(body, log):
+                continue
+            key = []
+            for source in composite['sources']:
+                (_, agg), = source.items()
+                if 'terms' in agg:
+                    key.append(log[agg['terms']['field']])
+                    continue
+                interval = int(agg['date_histogram']['fixed_interval'][:-2])
+                offset = int(agg['date_histogram'].get('offset', '+0ms')[1:-2])
+                millis = pd.Timestamp(log['@timestamp']).value // 10**6
+                key.append((millis - offset) // interval * interval + offset)
+            counts[tuple(key)] = counts.get(tuple(key), 0) + 1
+        keys = sorted(counts)
+        if 'after' in composite:
+            keys = [key for key in keys if key > tuple(composite['after'][name] for name in names)]
+        keys = keys[:composite['size']]
+        groups = {'buckets': [{'key': dict(zip(names, key)), 'doc_count': counts[key]} for key in keys]}
+        if keys:
+            groups['after_key'] = dict(zip(names, keys[-1]))
+        return {'aggregations': {'groups': groups}}
+
+
+def fake_scan(client, query, **kwargs):
+    return iter({'_source': log} for log in logs if in_range(query, log))
+
+
+@pytest.mark.parametrize('delta', ['5 min', '1h', '7 min', '25 min'])
+def test_aggregated_counts_match_scanned_counts(delta, monkeypatch):
+    monkeypatch.setattr(es, 'scan', fake_scan)
+    monkeypatch.setattr(es, 'get_client', lambda: FakeClient())
+    es._aggregatable_cache.clear()
+    args = dict(start = '2020-01-01T02:00', end = '2020-01-01T20:03', delta = delta,
+                group_keys = ['errkey', 'envname'])
+
+    scanned = info.error_counting(**args)
+    aggregated = info.error_counting(aggregate = True, **args)
+    for counts in (scanned, aggregated):
+        for column in counts.columns:
+            if counts[column].dtype.name == 'category':
+                counts[column] = counts[column].astype(str)
+    columns = list(scanned.columns)
+    pd.testing.assert_frame_equal(
+        scanned.sort_values(columns).reset_index(drop = True),
+        aggregated[columns].sort_values(columns).reset_index(drop = True),
+    )
@@ -0,0 +1,50 @@
+import time
+import networkx as nx
+import pandas as pd
+import pytest
+from parlogan.fsm import LogFSM, compiled_fsm
+
+def chain_fsm(n):
+    """_Start_ -> S0 -> S1 ... -> Sn-1, every state can also go back to S0"""
+    H = nx.DiGraph()
+    H.add_edge("_Start_", "S0")
+    for i in range(n):
+        H.nodes["S%d" % i]['filter'] = "step %03d;" % i
+        if i + 1 < n:
+            H.add_edge("S%d" % i, "S%d" % (i + 1))
+        H.add_edge("S%d" % i, "S0")
+    H.nodes["S0"]['opens'] = True
+    H.nodes["S%d" % (n - 1)]['closes'] = True
+    return H
+
+
+def test_many_filters():
+    n = 80
+    logs = pd.DataFrame({
+        '@timestamp': pd.date_range('2020-01-01', periods = 2 * n + 1, freq = 's', tz = 'UTC'),
+        'logtext': ["step %03d;" % i for i in range(n)] + ["noise"] + ["step %03d;" % i for i in range(n)],
+    })
+    started = time.time()
+    execs = LogFSM(chain_fsm(n)).executions(logs)
+    assert time.time() - started < 5
+    assert execs['start_row'].tolist() == [0, n + 1]
+    assert execs['end_row'].tolist() == [n - 1, 2 * n]
+
+
+def test_compiled_once():
+    assert compiled_fsm(chain_fsm(5)) is compiled_fsm(chain_fsm(5))
+    assert compiled_fsm(chain_fsm(5)) is not compiled_fsm(chain_fsm(6))
+
+
+def test_ambiguous_transitions():
+    H = nx.DiGraph([("_Start_", "A"), ("_Start_", "B")])
+    H.nodes["A"]['filter'] = "done"
+    H.nodes["B"]['filter'] = "done ok"
+    with pytest.raises(ValueError):
+        LogFSM(H)
+
+    H.nodes["B"]['filter'] = "ok"
+    with pytest.raises(ValueError):
+        LogFSM(H).transitions(pd.Series(["done ok"]))
+    H.nodes["B"]['priority'] = 1
+    assert LogFSM(H).transitions(pd.Series(["done ok"])) == [(0, 2)]
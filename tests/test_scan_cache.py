@@ -0,0 +1,47 @@
+import random
+import time
+import pandas as pd
+import parlogan.db.es.es as es
+
+base = pd.Timestamp('2020-01-01', tz = 'UTC')
+
+def fake_scan(client, query, **kwargs):
+    #one log a second after the start of the scan, with some latency
+    time.sleep(random.uniform(0, 0.02))
+    start = pd.to_datetime(query['query']['bool']['must'][1]['range']['@timestamp']['gte'], utc = True)
+    return iter([{'_source': {'@timestamp': (start + pd.Timedelta('1s')).isoformat(), 'logtext': 'x'}}])
+
+
+def test_concurrent_cached_scans_of_one_query(tmp_path, monkeypatch):
+    monkeypatch.setattr(es, 'es_cache_folder', str(tmp_path))
+    monkeypatch.setattr(es, 'scan', fake_scan)
+    monkeypatch.setattr(es, 'get_client', lambda: None)
+    #far apart, so they are not merged and are scanned at the same time
+    windows = [(base + pd.Timedelta(hours = 3 * i), base + pd.Timedelta(hours = 3 * i, minutes = 10))
+               for i in range(16)]
+
+    for _ in range(5):
+        es.clear_scan_cache()
+        logs = es.log_scan_windows('q', windows, cache = True, max_workers = 8)
+        assert [len(window_logs) for window_logs in logs] == [1] * len(windows)
+
+    #every chunk is in the index, a second pass is answered from the cache
+    monkeypatch.setattr(es, 'scan', None)
+    cached = es.log_scan_windows('q', windows, cache = True, max_workers = 8)
+    assert all(a.equals(b) for a, b in zip(logs, cached))
+
+
+def test_pooled_cached_scans_of_many_queries(tmp_path, monkeypatch):
+    monkeypatch.setattr(es, 'es_cache_folder', str(tmp_path))
+    monkeypatch.setattr(es, 'scan', fake_scan)
+    monkeypatch.setattr(es, 'get_client', lambda: None)
+    #like the executions of many systems: every query has many merged windows in flight
+    queries = ['UT%d AND q' % (i % 4 + 1) for i in range(32)]
+    windows = [(base + pd.Timedelta(hours = 3 * i), base + pd.Timedelta(hours = 3 * i, minutes = 10))
+               for i in range(32)]
+
+    logs = es.log_scan_windows(queries, windows, cache = True, max_workers = 8)
+    assert [len(window_logs) for window_logs in logs] == [1] * len(windows)
+    monkeypatch.setattr(es, 'scan', None)
+    cached = es.log_scan_windows(queries, windows, cache = True, max_workers = 8)
+    assert all(a.equals(b) for a, b in zip(logs, cached))